@@ -1,40 +1,82 @@
 import networkx as nx 
-import matplotlib.pyplot as plt
 import click as click
 import math
 import agent_system as agent
 import graphs as graphs
+import instrumentation as instrumentation
+import recording as recording
+import events as events
+import snapshot as snapshot
 import numpy as np
 
+class ResumableOption(click.Option):
+    # Not prompted when resuming a snapshot, which already holds the value
+    def prompt_for_value(self, ctx):
+        if ctx.params.get("resume") != None:
+            return None
+        return super().prompt_for_value(ctx)
+
 @click.command()
-@click.option('--exec-type', type=click.Choice(['Simulation','Execution'],case_sensitive=False), prompt='Program Mode',help='Program modes')
+@click.option('--exec-type', cls=ResumableOption, type=click.Choice(['Simulation','Execution'],case_sensitive=False), prompt='Program Mode',help='Program modes')
 @click.option('--visualization', type=click.Choice(['On','Off'],case_sensitive=False), prompt='Visualization',help='Visualization of the System')
-@click.option('--agent-behaviour', type=click.Choice(['Idle','Patrol','Station','Mix'],case_sensitive=False), prompt='Agent Behaviour',help='Behaviour of Emergency Agents')
-def aasma(exec_type, visualization, agent_behaviour):
+@click.option('--agent-behaviour', cls=ResumableOption, type=click.Choice(['Idle','Patrol','Station','Mix'],case_sensitive=False), prompt='Agent Behaviour',help='Behaviour of Emergency Agents, when resuming switches every agent to it')
+@click.option('--dispatch-mode', type=click.Choice(['Greedy','Batch'],case_sensitive=False), default=None,help='Dispatch of idle agents to unsatisfied emergencies, Greedy or the one of a resumed snapshot by default')
+@click.option('--frame-skip', type=click.IntRange(min=1), default=1, help='Simulation cycles per drawn frame when visualization is on')
+@click.option('--record', type=click.Path(writable=True), default=None, help='Render the run in a background process, to a video with ffmpeg (e.g. run.mp4) or to a directory of PNG frames')
+@click.option('--record-fps', type=click.IntRange(min=1), default=10, help='Frames per second of the recorded video')
+@click.option('--events', 'event_log', type=click.Path(dir_okay=False, writable=True), default=None, help='Stream emergency, dispatch, arrival and resolution events into a .jsonl, .npy or .parquet file')
+@click.option('--network', type=click.Path(exists=True, dir_okay=False), default=None, help='GraphML or edge list road network for Execution mode, instead of a grid')
+@click.option('--weight', default='weight', help='Edge attribute of the road network holding travel times')
+@click.option('--seed', type=int, default=None, help='Seed of the random generators, for reproducible runs')
+@click.option('--timings', type=click.Path(dir_okay=False, writable=True), default=None, help='Record the time of every phase of every cycle into this JSON file')
+@click.option('--profile', type=click.Path(dir_okay=False, writable=True), default=None, help='Run under cProfile and tracemalloc, dumping PROFILE.prof and PROFILE.txt')
+@click.option('--checkpoint', type=click.Path(dir_okay=False, writable=True), default=None, help='Snapshot file the run is paused into at --checkpoint-at')
+@click.option('--checkpoint-at', type=click.IntRange(min=0), default=None, help='Cycle at which the run is paused and saved to --checkpoint')
+@click.option('--resume', type=click.Path(exists=True, dir_okay=False), default=None, is_eager=True, help='Continue the run saved in this snapshot, a new seed or behaviour forks it')
+def aasma(exec_type, visualization, agent_behaviour, dispatch_mode, frame_skip, record, record_fps, event_log, network, weight, seed, timings, profile, checkpoint, checkpoint_at, resume):
     """A Multi-Agent resource management program. It has two distinct program modes:\n
     \tSimulation: A list of fixed scenarios where the program will simulate its functionality according
     to distinct probablistic distributions of emergencies (uniform, normal, linear, exponential) and different agent behaviours, for 100 program cycles\n
     \t(Agent Behaviour: Idle=will remain in the same location until asked to move, Patrol=patrols locations when not solving an emergency, Station=returns to station location after solving an emergency, Mix=random choice between idle, patrol and station)\n
     \tExecution: A custom scenario where the user can define Graph node size, number of resources,
-    number of emergencies and the number of program cycles\n""" 
+    number of emergencies and the number of program cycles\n
+    \t(Checkpoints: --checkpoint with --checkpoint-at pauses a run into a snapshot file, --resume continues it from there)\n
+    \t(Dispatch Mode: Greedy=each idle agent takes its closest unsatisfied emergency, Batch=idle agents are assigned to unsatisfied emergencies all at once, minimizing total distance weighted by emergency type)\n""" 
     
-    user_input(exec_type, visualization, agent_behaviour, None)
+    if (checkpoint == None) != (checkpoint_at == None):
+        raise click.UsageError("--checkpoint and --checkpoint-at must be given together")
+
+    user_input(exec_type, visualization, agent_behaviour, None, dispatch_mode, seed, timings, profile, frame_skip, record, record_fps, event_log, network, weight, checkpoint, checkpoint_at, resume)
 
-def user_input(exec_type, visualization, agent_behaviour, emergency_evaluation):
+def user_input(exec_type, visualization, agent_behaviour, emergency_evaluation, dispatch_mode="Greedy", seed=None, timings=None, profile=None, frame_skip=1, record=None, record_fps=10, event_log=None, network=None, weight="weight", checkpoint=None, checkpoint_at=None, resume=None):
     graph = None
+    graph_rng, agent_rng = graphs.simulation_generators(seed)
     node_size = 0
     resources = 0
     emergencies = 0
     cycles = 0
 
-    if(exec_type =="Simulation"):
+    if resume != None:
+        try:
+            graph, city_agent = snapshot.load_snapshot(resume, visualization)
+            snapshot.fork(graph, city_agent, seed, agent_behaviour)
+        except ValueError as error:
+            raise click.BadParameter(str(error))
+        exec_type = graph.exec_type
+        resources = len(city_agent.resource_agents_list)
+        emergencies = graph.total_emergencies
+        cycles = graph.total_cycles
+
+        print("\nResuming the run saved in " + resume + " at cycle " + str(graph.current_cycle_count) + " of " + str(cycles))
+
+    elif(exec_type =="Simulation"):
         options = ['Uniform', 'Normal', 'Linear', 'Exponential']
         distribution = click.prompt('Choose the distribution of emergencies throughout the program\n[Uniform, Normal, Linear, Exponential]')
 
         while distribution not in options:
             distribution = click.prompt('Invalid input\n. Choose the distribution of emergencies throughout the program\n[Uniform, Normal, Linear, Exponential]')
 
-        graph = graphs.Graph(visualization)
+        graph = graphs.Graph(visualization, graph_rng)
         result = []
 
         if distribution == 'Uniform':
@@ -58,9 +100,10 @@ def user_input(exec_type, visualization, agent_behaviour, emergency_evaluation):
         print("Program cycles: " + str(cycles))
 
     elif(exec_type == "Execution"):
-        node_size = click.prompt('Choose the Graphs node size', type=int)
-        while node_size <= 0:
-            node_size = click.prompt('Not a positive Integer. Choose the Graphs node size', type=int)
+        if network == None:
+            node_size = click.prompt('Choose the Graphs node size', type=int)
+            while node_size <= 0:
+                node_size = click.prompt('Not a positive Integer. Choose the Graphs node size', type=int)
 
         resources = click.prompt('Number of resources', type=int)
         while resources <= 0:
@@ -76,38 +119,67 @@ def user_input(exec_type, visualization, agent_behaviour, emergency_evaluation):
 
         distribution = "Uniform"
         
-        root = math.floor(math.sqrt(node_size))
-        graph = graphs.Graph(visualization)
+        graph = graphs.Graph(visualization, graph_rng)
         graph.initial_setup(emergencies,cycles)
-        graph.generate_grid_graph(root,root)
+        if network != None:
+            graph.load_road_network(network, weight)
+            print("Road network with " + str(len(graph.node_list)) + " nodes and " + str(graph.graph.number_of_edges()) + " roads")
+        else:
+            root = math.floor(math.sqrt(node_size))
+            graph.generate_grid_graph(root,root)
 
     print("\nWelcome to our emergency resource management Multi-Agent system. You have chosen "+exec_type+" mode.")
 
-    city_agent = agent.City_Agent()
-    city_agent.initial_setup(graph, resources, agent_behaviour)
-    graph.city_agent = city_agent
+    if resume == None:
+        city_agent = agent.City_Agent(agent_rng)
+        city_agent.initial_setup(graph, resources, agent_behaviour)
+        graph.city_agent = city_agent
+
+        graph.exec_type = exec_type
+        graph.behaviour = agent_behaviour
+        graph.distribution = distribution
+
+    if dispatch_mode != None:
+        graph.dispatch_mode = dispatch_mode
+    graph.frame_skip = frame_skip
+
+    if record != None:
+        graph.start_recording(recording.FrameRecorder(graph, record, record_fps))
 
-    graph.exec_type = exec_type
-    graph.behaviour = agent_behaviour
-    graph.distribution = distribution
+    if event_log != None:
+        try:
+            graph.set_event_log(events.EventLog(event_log))
+        except ValueError as error:
+            raise click.BadParameter(str(error))
 
-    Loop(graph, resources, emergencies, cycles, city_agent, emergency_evaluation)
+    if timings != None:
+        graph.set_instrumentation(instrumentation.Instrumentation())
 
-def Loop(graph, resources, emergencies, cycles, city_agent, emergency_evaluation):
-    cycle_count = 0
+    Loop(graph, resources, emergencies, cycles, city_agent, emergency_evaluation, timings, profile, checkpoint, checkpoint_at)
+
+def Loop(graph, resources, emergencies, cycles, city_agent, emergency_evaluation, timings=None, profile=None, checkpoint=None, checkpoint_at=None):
     graph.visualize_graph()
 
     if emergency_evaluation != None:
         city_agent.emergency_evaluation = emergency_evaluation
-    
-    while cycle_count <= cycles or len(city_agent.active_emergencies) > 0:
-        graph.cycle_passed(cycle_count)
-        cycle_count += 1
 
-        for agent in city_agent.resource_agents_list:
-            city_agent.resource_agents_list[agent].move_agent()
+    if profile != None:
+        cycle_count = instrumentation.profiled(lambda: simulate(graph, city_agent, cycles, checkpoint_at), profile)
+    else:
+        cycle_count = simulate(graph, city_agent, cycles, checkpoint_at)
 
     graph.end_visualize_graph()
+    recorded = graph.stop_recording()
+    logged = graph.events.close()
+
+    if timings != None:
+        graph.instrumentation.dump(timings)
+
+    # Stopped before every emergency was answered, so the run is paused at the checkpoint
+    if cycle_count <= cycles or len(city_agent.active_emergencies) > 0:
+        snapshot.save_snapshot(graph, city_agent, checkpoint)
+        print("\nProgram paused at cycle " + str(cycle_count) + ". State saved to " + checkpoint + ", continue it with --resume " + checkpoint)
+        return
 
     print("\nProgram completed. Presenting statistics:\n")
     print("Number of cycles to effectively answer all emergencies: " + str(cycle_count))
@@ -116,6 +188,29 @@ def Loop(graph, resources, emergencies, cycles, city_agent, emergency_evaluation
     print("   All types: " + str(round(response_success[0],3)) + " %")
     for i in range(1, 6):
          print("   Type " + str(i) + ": " + str(round(response_success[i],3)) + " %")
+    print("Average first response and resolution time (cycles): ")
+    response_times = city_agent.calculate_response_times()
+    for i in response_times:
+         print("   Type " + str(i) + ": " + str(round(response_times[i][0],3)) + ", " + str(round(response_times[i][1],3)))
+    print("First response and resolution time percentiles (p50, p90, p99): ")
+    time_quantiles = city_agent.statistics.quantiles()
+    for i in time_quantiles:
+         print("   Type " + str(i) + ": " + ", ".join(str(round(value,1)) for value in time_quantiles[i]["response"].values()) + " / " + ", ".join(str(round(value,1)) for value in time_quantiles[i]["resolution"].values()))
+    print("Dispatch time per cycle (" + graph.dispatch_mode + "): ")
+    print("   Mean: " + str(round(graph.dispatch_times.mean()*1000,3)) + " ms")
+    print("   Max: " + str(round(graph.dispatch_times.maximum*1000,3)) + " ms")
+    if graph.instrumentation.enabled:
+        summary = graph.instrumentation.summary()
+        print("Time per phase (total, mean per cycle, max per cycle): ")
+        for phase in graph.instrumentation.calls:
+            print("   " + phase + ": " + str(round(summary[phase]["total_ms"],3)) + " ms, " + str(round(summary[phase]["mean_ms"],3)) + " ms, " + str(round(summary[phase]["max_ms"],3)) + " ms")
+        print("   Shortest-path queries: " + str(summary["path_queries"]))
+    if graph.events.enabled:
+        print("Events: " + str(logged) + " written to " + graph.events.path)
+    if recorded != None and "error" in recorded:
+        print("Recording failed: " + recorded["error"])
+    elif recorded != None:
+        print("Recording: " + str(recorded["frames"]) + " frames written to " + recorded["path"])
     print("Final result of Reinforcement Learning in resource distribution: ")
     emergency_evaluation = city_agent.emergency_evaluation
     for i in range(1, 6):
@@ -127,6 +222,7 @@ def Loop(graph, resources, emergencies, cycles, city_agent, emergency_evaluation
         options = ['Execution', 'Simulation']
         visualization_options = ['On', 'Off']
         behaviour_options = ['Idle', 'Patrol', 'Station', 'Mix']
+        dispatch_options = ['Greedy', 'Batch']
 
         exec_mode = click.prompt('\nStarting new program execution. Choose mode to start new program\n[Simulation, Execution]')
         while exec_mode not in options:
@@ -140,7 +236,31 @@ def Loop(graph, resources, emergencies, cycles, city_agent, emergency_evaluation
         while behaviour not in behaviour_options:
             behaviour = click.prompt('Invalid input.\nAgent Behaviour\n[Idle, Patrol, Station, Mix]')
 
-        user_input(exec_mode, visualization, behaviour, emergency_evaluation)
+        dispatch_mode = click.prompt('\nDispatch Mode\n[Greedy, Batch]')
+        while dispatch_mode not in dispatch_options:
+            dispatch_mode = click.prompt('Invalid input.\nDispatch Mode\n[Greedy, Batch]')
+
+        user_input(exec_mode, visualization, behaviour, emergency_evaluation, dispatch_mode, frame_skip=graph.frame_skip)
+
+def simulate(graph, city_agent, cycles, pause_at=None):
+    # Continues from the cycle the graph is at, stopping early at pause_at
+    cycle_count = graph.current_cycle_count
+    instrumentation = graph.instrumentation
+
+    while cycle_count <= cycles or len(city_agent.active_emergencies) > 0:
+        if pause_at != None and cycle_count >= pause_at:
+            break
+        instrumentation.begin_cycle()
+        graph.cycle_passed(cycle_count)
+        cycle_count += 1
+
+        phase_start = instrumentation.start()
+        for agent in city_agent.resource_agents_list:
+            city_agent.resource_agents_list[agent].move_agent()
+        instrumentation.stop("movement", phase_start)
+        instrumentation.end_cycle()
+
+    return cycle_count
 
 def debug_log(city_agent):
     city_agent.debug_log()
@@ -1,13 +1,19 @@
 import networkx as nx 
-import matplotlib.pyplot as plt
 import click as click
 import math
 import graphs as graphs
+import routing as routing
+import events as events
+import metrics as metrics
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 
 class City_Agent:
 
-    def __init__(self):
+    def __init__(self, rng=None):
+
+        #Random generator for agent behaviours and patrols
+        self.rng = np.random.default_rng(rng)
 
         #City graph
         self.city_graph = None
@@ -23,43 +29,99 @@ class City_Agent:
 
         self.unsatisfied_emergencies = {}
 
+        #Agents assigned to each active emergency, in dispatch order
+        self.responders = {}
+
         self.emergency_evaluation = {}
-        self.emergency_evaluation_history = {}
 
-        self.emergency_time = {}
+        #Streaming statistics of resolved emergencies, an exponentially weighted evaluation when a decay is set
+        self.evaluation_decay = None
+        self.statistics = metrics.EmergencyStatistics()
 
         self.stations = {}
 
+        #Nearest station of every node and the step toward it, by node index,
+        #with the routing version they were computed on
+        self.station_regions = None
+        self.station_next_hops = None
+        self.station_partition_version = None
+
+        #Batch dispatch cost multiplier per emergency type
+        self.dispatch_weights = {1: 1, 2: 2, 3: 3, 4: 4, 5: 5}
+
     def initial_setup(self, graph, resources, behaviour):
         self.register_graph(graph)
 
         #TODO make different possibilities
         for i in range(1, 6):
             self.emergency_evaluation[i] = 0
-            self.emergency_evaluation_history[i] = []
-            self.emergency_time[i] = []
-
-        if behaviour == "Station" or behaviour == "Mix":
-            for i in range(int(math.sqrt(graph.graph.size()))):
-                self.stations[i] = graph.random_graph_position()
+        self.statistics = metrics.EmergencyStatistics(self.evaluation_decay)
 
         self.resource_agents_list = {}
         self.available_agents = {}
         self.unavailable_agents = {}
+        self.responders = {}
+
+        self.add_agents(resources, behaviour)
 
-        for i in range(resources):
+    def create_stations(self):
+        graph = self.city_graph
+        for i in range(int(math.sqrt(graph.edge_count()))):
+            self.stations[i] = graph.random_graph_position()
+        self.station_partition_version = None
+
+    def agent_behaviour(self, behaviour):
+        if behaviour == "Mix":
+            return str(self.rng.choice(["Idle","Patrol","Station"]))
+        return behaviour
+
+    def add_agents(self, resources, behaviour):
+        #Stations are placed the first time a behaviour needs them, new agents are named after the existing ones
+        if (behaviour == "Station" or behaviour == "Mix") and len(self.stations) == 0:
+            self.create_stations()
+
+        first = max(self.resource_agents_list, default=-1) + 1
+        for i in range(first, first + resources):
             resource_agent = Resource_Agent()
-            if behaviour == "Mix":
-                current_behaviour = np.random.choice(["Idle","Patrol","Station"])
-            else:
-                current_behaviour = behaviour
+            current_behaviour = self.agent_behaviour(behaviour)
             if current_behaviour == "Station":
-                location = self.stations[np.random.randint(len(self.stations))]
+                location = self.stations[self.rng.integers(len(self.stations))]
             else:
-                location = graph.random_graph_position()
-            resource_agent.initial_setup(i, graph, location, current_behaviour, self)
+                location = self.city_graph.random_graph_position()
+            resource_agent.initial_setup(i, self.city_graph, location, current_behaviour, self)
             self.register_agent(resource_agent)
 
+    def remove_agents(self, resources):
+        #Available agents leave the fleet first, the most recently added first. A busy agent
+        #leaves its emergency, which then asks for one more resource
+        agent_ids = sorted(self.available_agents, reverse=True) + sorted(self.unavailable_agents, reverse=True)
+        if resources > len(agent_ids):
+            raise ValueError("Cannot remove " + str(resources) + " agents from a fleet of " + str(len(agent_ids)))
+        for agent_id in agent_ids[:resources]:
+            resource_agent = self.resource_agents_list.pop(agent_id)
+            if agent_id in self.available_agents:
+                del self.available_agents[agent_id]
+            else:
+                del self.unavailable_agents[agent_id]
+                self.release_responder(resource_agent)
+            self.city_graph.remove_resource_by_index(resource_agent.location_index, agent_id)
+
+    def release_responder(self, agent):
+        emergency = agent.active_emergency
+        self.responders[emergency.id].remove(agent)
+        emergency.node.on_scene = [entry for entry in emergency.node.on_scene if entry[1] is not agent]
+        if emergency.id in self.unsatisfied_emergencies:
+            self.unsatisfied_emergencies[emergency.id] = (emergency, self.unsatisfied_emergencies[emergency.id][1] + 1)
+        else:
+            self.unsatisfied_emergencies[emergency.id] = (emergency, 1)
+
+    def set_behaviour(self, behaviour):
+        #Every agent takes up the new behaviour, busy agents once they are released
+        if (behaviour == "Station" or behaviour == "Mix") and len(self.stations) == 0:
+            self.create_stations()
+        for agent_id in self.resource_agents_list:
+            self.resource_agents_list[agent_id].set_behaviour(self.agent_behaviour(behaviour))
+
 
     def register_graph(self, graph):
         self.city_graph = graph
@@ -79,36 +141,74 @@ class City_Agent:
     def dispatch_closest_emergency(self, agent):
         if len(self.unsatisfied_emergencies) == 0:
             return
-        path_lengths = {}
-        for emergency_id in self.unsatisfied_emergencies:
-            emergency = self.unsatisfied_emergencies[emergency_id][0]
-            path_lengths[emergency_id] = len(agent.evaluate_shortest_path(agent.current_location, emergency.location))
-        emergency_id = min(path_lengths, key=path_lengths.get)
+        # One column of the shortest-path trees rooted at the emergencies, shared by every agent
+        emergency_ids = list(self.unsatisfied_emergencies)
+        locations = [self.unsatisfied_emergencies[emergency_id][0].location for emergency_id in emergency_ids]
+        path_lengths = self.city_graph.routing.distance_matrix(locations, [agent.current_location])[:, 0]
+        closest = int(np.argmin(path_lengths))
+        #No emergency can be reached from a part of the roads cut off from all of them
+        if not np.isfinite(path_lengths[closest]):
+            return
+        emergency_id = emergency_ids[closest]
         emergency = self.unsatisfied_emergencies[emergency_id][0]
         resources_left = self.unsatisfied_emergencies[emergency_id][1]
         if(resources_left <= 0):
             del self.unsatisfied_emergencies[emergency_id]
         else:
             self.unsatisfied_emergencies[emergency_id] = (emergency, resources_left-1)
+        self.assign(agent, emergency, path_lengths[closest])
+        
+
+    def dispatch_batch(self):
+        if len(self.unsatisfied_emergencies) == 0 or len(self.available_agents) == 0:
+            return
+        agent_ids = list(self.available_agents)
+        agent_locations = [self.available_agents[agent_id].current_location for agent_id in agent_ids]
+
+        emergency_ids = list(self.unsatisfied_emergencies)
+        emergencies = [self.unsatisfied_emergencies[emergency_id][0] for emergency_id in emergency_ids]
+        resources_left = [self.unsatisfied_emergencies[emergency_id][1] for emergency_id in emergency_ids]
+        distances = self.city_graph.routing.distance_matrix([emergency.location for emergency in emergencies], agent_locations)
+
+        for agent_row, emergency_row in batch_assignment(resources_left, [emergency.type for emergency in emergencies], distances, self.dispatch_weights):
+            emergency_id = emergency_ids[emergency_row]
+            emergency = self.unsatisfied_emergencies[emergency_id][0]
+            resources_left = self.unsatisfied_emergencies[emergency_id][1] - 1
+            if resources_left <= 0:
+                del self.unsatisfied_emergencies[emergency_id]
+            else:
+                self.unsatisfied_emergencies[emergency_id] = (emergency, resources_left)
+            self.assign(self.available_agents[agent_ids[agent_row]], emergency, distances[emergency_row, agent_row])
+
+    def assign(self, agent, emergency, distance):
         agent.receive_emergency(emergency)
         self.register_unavailable_agent(agent)
-        
+        self.responders.setdefault(emergency.id, []).append(agent)
+
+        #An agent dispatched where it already stands is on scene right away
+        graph = self.city_graph
+        if agent.location_index == emergency.node.index:
+            graph.add_on_scene(emergency.node.index, agent)
+        graph.events.record(graph.current_cycle_count, events.DISPATCHED, emergency.id, agent.name, agent.location_index, events.as_value(distance))
+
+    def update_station_partition(self):
+        graph = self.city_graph
+        if self.station_partition_version == graph.routing_version:
+            return
+        station_indices = [graph.node_index[self.stations[station_id]] for station_id in self.stations]
+        self.station_regions, self.station_next_hops = graph.routing.nearest_sources(station_indices)
+        self.station_partition_version = graph.routing_version
 
     def closest_station(self, agent):
         if len(self.stations) == 0:
             return None
-        path = {}
-        path_lengths = {}
-        for station_id in self.stations:
-            station = self.stations[station_id]
-            path[station_id] = agent.evaluate_shortest_path(agent.current_location, station)
-            path_lengths[station_id] = len(path[station_id])
-        station_id = min(path_lengths, key=path_lengths.get)
-        
-        if len(path[station_id]) > 1:
-            return path[station_id][1]
-        else:
-            return path[station_id][0]
+        # Table read from the station partition, rebuilt only when the stations or the roads change
+        self.update_station_partition()
+        hop = int(self.station_next_hops[agent.location_index])
+        if hop < 0:
+            raise nx.NetworkXNoPath("No station reachable from " + str(agent.current_location))
+
+        return self.city_graph.node_list[hop]
 
     def register_unavailable_agent(self, agent):
         if agent.name not in self.unavailable_agents:
@@ -125,92 +225,61 @@ class City_Agent:
                 resources_needed = 1
             self.dispatch_resources(emergency, resources_needed)
 
-    def update_emergency_evaluation(self, emergency, severity):
-        self.emergency_evaluation_history[emergency.type].append(severity)
-        self.emergency_evaluation[emergency.type] = int(np.mean(self.emergency_evaluation_history[emergency.type]))
+    def record_resolution(self, emergency_type, severity, response_time, longevity):
+        self.statistics.record(emergency_type, severity, response_time, longevity - response_time)
+        self.emergency_evaluation[emergency_type] = self.statistics.evaluation(emergency_type)
 
     def delete_emergency(self, emergency):
-        unavailable_agents_list = list(self.unavailable_agents)
-
         total_severity = 0
         total_agents = 0
 
-        for agent_id in unavailable_agents_list:
-            agent = self.unavailable_agents[agent_id]
-
-            if agent.emergency_location == emergency.location:
-                total_severity = agent.calculate_severity()
-                total_agents += 1
-                agent.end_emergency()
+        for agent in self.responders.pop(emergency.id):
+            total_severity = agent.calculate_severity()
+            total_agents += 1
+            self.city_graph.events.record(self.city_graph.current_cycle_count, events.RELEASED, emergency.id, agent.name, agent.location_index, agent.dispatch_time)
+            agent.end_emergency()
         
-        self.update_emergency_evaluation(emergency, total_severity / total_agents)
-
-        self.emergency_time[emergency.type].append((emergency.response_time, emergency.longevity - emergency.response_time))
+        self.record_resolution(emergency.type, total_severity / total_agents, emergency.response_time, emergency.longevity)
 
         if emergency.id in self.unsatisfied_emergencies:
             del self.unsatisfied_emergencies[emergency.id]
         del self.active_emergencies[emergency.id]
 
     def dispatch_resources(self, emergency, resources_needed):
-        path_lengths = {}
+        agent_ids = list(self.available_agents)
+        agent_locations = [self.available_agents[agent_id].current_location for agent_id in agent_ids]
 
-        for agent_id in self.available_agents:
-            agent = self.available_agents[agent_id]
-            path_lengths[agent_id] = len(agent.evaluate_shortest_path(agent.current_location, emergency.location))
+        # One single-source query from the emergency gives every agent's distance
+        path_lengths = self.city_graph.routing.distances(emergency.location, agent_locations)
+        closest_agents = routing.nearest(path_lengths, resources_needed)
 
         for i in range(resources_needed):
-            if path_lengths == {}:
+            if i >= len(closest_agents):
                 self.unsatisfied_emergencies[emergency.id] = (emergency, resources_needed - i)
                 return
-            agent_id = min(path_lengths, key=path_lengths.get)
-            agent = self.available_agents[agent_id]
-
-            agent.receive_emergency(emergency)
-            self.register_unavailable_agent(agent)
-            del path_lengths[agent_id]
+            self.assign(self.available_agents[agent_ids[closest_agents[i]]], emergency, path_lengths[closest_agents[i]])
 
     def get_resources_locations(self):
-        resource_list = {}
-
-        for agent in self.resource_agents_list:
-            location = self.resource_agents_list[agent].current_location
-            if location in resource_list:
-                resource_list[location] += 1
-            else:
-                resource_list[location] = 1
-
-        return resource_list
+        # Read from the occupancy the graph keeps up to date on every move
+        graph = self.city_graph
+        occupied = np.flatnonzero(graph.occupancy)
+        return {graph.node_list[index]: count for index, count in zip(occupied.tolist(), graph.occupancy[occupied].tolist())}
 
     def move_resource(self, resource_id, current_location, next_location):
-        self.city_graph.remove_resource(current_location, resource_id)
-        self.city_graph.add_resource(next_location, resource_id, self.resource_agents_list[resource_id])
+        self.move_resource_by_index(resource_id, self.city_graph.node_index[current_location], self.city_graph.node_index[next_location])
 
-    def calculate_response_success(self):
-        
-        total_recorded_responses = 0
-        total_succesful_responses = 0
-        first_response = [12,10,8,7,5]
-        resolution_time = [5,6,8,12,16]
-        response_success = {}
-
-        for i in range(5):
-            num_recorded_responses = 0
-            num_succesful_responses = 0
-        
-            for t in self.emergency_time[i + 1]:
-                if t[0] <= first_response[i] and t[1] <= resolution_time[i]:
-                    num_succesful_responses += 1
-                num_recorded_responses += 1
+    def move_resource_by_index(self, resource_id, current_index, next_index):
+        agent = self.resource_agents_list[resource_id]
+        self.city_graph.remove_resource_by_index(current_index, resource_id)
+        self.city_graph.add_resource_by_index(next_index, resource_id, agent)
+        if agent.emergency_index == next_index:
+            self.city_graph.add_on_scene(next_index, agent)
 
-            if num_recorded_responses != 0:
-                response_success[i + 1] =  (num_succesful_responses / num_recorded_responses) * 100
-            
-            total_recorded_responses += num_recorded_responses
-            total_succesful_responses += num_succesful_responses
+    def calculate_response_success(self):
+        return self.statistics.response_success()
 
-        if total_recorded_responses != 0:
-            response_success[0] = (total_succesful_responses / total_recorded_responses) * 100
-        return response_success
+    def calculate_response_times(self):
+        return self.statistics.mean_times()
 
 
     def debug_log(self):
@@ -230,8 +299,35 @@ class City_Agent:
         print(self.active_emergencies)
 
 
+def batch_assignment(resources_left, emergency_types, distances, weights):
+    agent_count = distances.shape[1]
+
+    #One slot per missing resource, most severe emergencies first when agents are scarce
+    emergency_rows = sorted(range(len(resources_left)), key=lambda row: -emergency_types[row])
+    slots = []
+    for row in emergency_rows:
+        slots.extend([row] * resources_left[row])
+    slots = slots[:agent_count]
+    if len(slots) == 0:
+        return []
+
+    #Agents x slots cost, distance weighted by emergency type
+    slot_weights = np.array([weights[emergency_types[row]] for row in slots])
+    cost = distances[slots].T * slot_weights
+    unreachable = ~np.isfinite(cost)
+    if unreachable.all():
+        return []
+    cost[unreachable] = cost[~unreachable].max() * len(slots) + 1
+
+    agent_rows, slot_columns = linear_sum_assignment(cost)
+    return [(agent_row, slots[slot_column]) for agent_row, slot_column in zip(agent_rows, slot_columns) if not unreachable[agent_row, slot_column]]
+
 class Resource_Agent:
 
+    __slots__ = ("name", "city_graph", "city_agent", "current_location", "location_index", "available", "active_emergency", "emergency_location", "emergency_index",
+        "dispatch_time", "travel_time", "behaviour", "station", "station_index", "arrival", "route", "route_cursor", "route_version",
+        "travel_budget", "patrol_target")
+
     def __init__(self):
 
         #Agent name
@@ -243,8 +339,9 @@ class Resource_Agent:
         #Main agent responsible for all coordination
         self.city_agent = None
 
-        #Current location in the graph node
+        #Current location in the graph node, and its node index
         self.current_location = None
+        self.location_index = None
 
         #Availability status
         self.available = True
@@ -252,8 +349,9 @@ class Resource_Agent:
         #Current Emergency State
         self.active_emergency = None
 
-        #Emergency Location
+        #Emergency Location, and its node index or -1
         self.emergency_location = None
+        self.emergency_index = -1
 
         #Time Handling emergency
         self.dispatch_time = None
@@ -264,33 +362,63 @@ class Resource_Agent:
         #Movement Behaviour
         self.behaviour = None
 
-        #Assigned Station
+        #Assigned Station, and its node index
         self.station = None
+        self.station_index = None
+
+        #Order of arrival at the current location, stamped by the graph
+        self.arrival = 0
+
+        #Route being walked as node indices, cursor at the current node and routing version it was built on
+        self.route = None
+        self.route_cursor = 0
+        self.route_version = None
+
+        #Travel time left over from earlier cycles toward the next edge, and the neighbour a patrol is crossing to or -1
+        self.travel_budget = 0.0
+        self.patrol_target = -1
 
     def initial_setup(self, name, graph, current_location, behaviour, city_agent):
         self.name = name
         self.city_graph = graph
         self.current_location = current_location
+        self.location_index = graph.node_index[current_location]
         self.city_agent = city_agent
+        self.set_behaviour(behaviour)
+
+    def set_behaviour(self, behaviour):
         self.behaviour = behaviour
+        self.travel_budget = 0.0
+        self.patrol_target = -1
+        self.station = None
+        self.station_index = None
         if behaviour == "Station":
-            self.station = city_agent.closest_station(self)
+            self.station = self.city_agent.closest_station(self)
+            self.station_index = self.city_graph.node_index[self.station]
 
     def receive_emergency(self, received_emergency):
         if self.available:
             self.active_emergency = received_emergency
             self.emergency_location = received_emergency.location
+            self.emergency_index = received_emergency.node.index
             self.available = False
             self.dispatch_time = 0
             self.travel_time = 0
+            self.route = None
+            self.travel_budget = 0.0
+            self.patrol_target = -1
 
     def end_emergency(self):
         if self.active_emergency != None:
             self.available = True
             self.active_emergency = None
             self.emergency_location = None
+            self.emergency_index = -1
             self.dispatch_time = 0
             self.travel_time = 0
+            self.route = None
+            self.travel_budget = 0.0
+            self.patrol_target = -1
 
         self.city_agent
         self.city_agent.register_available_agent(self)
@@ -303,34 +431,85 @@ class Resource_Agent:
 
     def move_agent(self):
         if not self.available and self.emergency_location != None:
-            if self.current_location != self.emergency_location:
-                next_position = self.next_position(self.emergency_location)
-                self.city_agent.move_resource(self.name, self.current_location, next_position)
-                self.current_location = next_position
+            if self.location_index != self.emergency_index:
+                self.travel_towards(self.emergency_index)
                 self.travel_time += 1
         else:
             if self.behaviour == "Idle":
                 return
             elif self.behaviour == "Patrol":
-                adj_positions = list(self.city_agent.city_graph.graph.neighbors(self.current_location))
-                next_position = adj_positions[np.random.randint(len(adj_positions))]
-                self.city_agent.move_resource(self.name, self.current_location, next_position)
-                self.current_location = next_position
+                self.patrol()
             elif self.behaviour == "Station":
                 if self.current_location not in self.city_agent.stations:
-                    next_position = self.next_position(self.station)
-                    self.city_agent.move_resource(self.name, self.current_location, next_position)
-                    self.current_location = next_position
-
-    def next_position(self, location):
-        path = self.evaluate_shortest_path(self.current_location, location)
-        if len(path) > 1:
-            return path[1]
-        else:
-            return path[0]
+                    if self.location_index == self.station_index:
+                        self.move_to(self.location_index)
+                    else:
+                        self.travel_towards(self.station_index)
+
+    def travel_towards(self, destiny):
+        # Every cycle adds one unit of travel time, edges are crossed while it covers their
+        # weight and what is left waits for the next cycle, so routes take as long as they weigh
+        routing = self.city_graph.routing
+        self.travel_budget += 1
+        while self.location_index != destiny:
+            next_index = self.next_position(destiny)
+            weight = routing.edge_weight_by_index(self.location_index, next_index)
+            if weight > self.travel_budget:
+                break
+            self.travel_budget -= weight
+            self.route_cursor += 1
+            self.move_to(next_index)
+
+        if self.location_index == destiny:
+            self.travel_budget = 0.0
+
+    def patrol(self):
+        # Random neighbours are drawn one edge at a time, each once the previous edge is crossed.
+        # The step limit only stops edges of zero travel time from looping forever
+        neighbours = self.city_graph.neighbours
+        routing = self.city_graph.routing
+        self.travel_budget += 1
+        for step in range(len(self.city_graph.node_list)):
+            if self.travel_budget <= 0:
+                break
+            if self.patrol_target < 0:
+                choice = self.city_agent.rng.integers(neighbours.degrees(self.location_index))
+                self.patrol_target = int(neighbours.neighbour(self.location_index, choice))
+            weight = routing.edge_weight_by_index(self.location_index, self.patrol_target)
+            if weight > self.travel_budget:
+                break
+            self.travel_budget -= weight
+            next_index = self.patrol_target
+            self.patrol_target = -1
+            self.move_to(next_index)
+
+    def move_to(self, next_index):
+        self.city_agent.move_resource_by_index(self.name, self.location_index, next_index)
+        self.location_index = next_index
+        self.current_location = self.city_graph.node_list[next_index]
+
+    def next_position(self, destiny):
+        graph = self.city_graph
+
+        # The route is computed once per destination and then only walked, the caller
+        # advancing route_cursor once it steps onto the returned node
+        if self.route is None or self.route[-1] != destiny or self.route_version != graph.routing_version or self.route[self.route_cursor] != self.location_index:
+            self.route = graph.routing.path_by_index(self.location_index, destiny)
+            self.route_cursor = 0
+            self.route_version = graph.routing_version
+
+        if self.route_cursor + 1 < len(self.route):
+            return int(self.route[self.route_cursor + 1])
+        return int(self.route[self.route_cursor])
+
+    def eta(self):
+        # Edges left on the current route
+        if self.route is None:
+            return None
+        return len(self.route) - 1 - self.route_cursor
 
     def evaluate_shortest_path(self, source, destiny, weight=None):
-        return nx.shortest_path(self.city_graph.graph, source = source, target = destiny)
+        return nx.shortest_path(self.city_graph.graph, source = source, target = destiny, weight = weight)
 
     def currently_assisting(self):
         return self.emergency_location != None and self.current_location == self.emergency_location 
@@ -0,0 +1,185 @@
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+import click as click
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import agent_system as agent
+import graphs as graphs
+import vector_engine as vector_engine
+
+# Benchmark cases as (grid side, fleet size, emergencies, cycles)
+PRESETS = {
+    "quick": [(15, 100, 1500, 1000), (50, 1000, 15000, 1000), (100, 10000, 100000, 1000)],
+    "full": [(15, 100, 1500, 1000), (50, 1000, 15000, 1000), (100, 10000, 100000, 1000), (250, 50000, 500000, 1000), (500, 100000, 1000000, 1000)],
+}
+
+PERCENTILES = [50, 90, 99]
+
+class PhaseTimer:
+
+    def __init__(self):
+
+        # Latency samples in seconds per phase
+        self.samples = {}
+
+    def wrap(self, owner, name, phase):
+        method = getattr(owner, name)
+        samples = self.samples.setdefault(phase, [])
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            samples.append(time.perf_counter() - start)
+            return result
+
+        setattr(owner, name, timed)
+
+    def time(self, phase, function):
+        start = time.perf_counter()
+        function()
+        self.samples.setdefault(phase, []).append(time.perf_counter() - start)
+
+    def report(self):
+        report = {}
+        for phase in self.samples:
+            samples = np.array(self.samples[phase])
+            if len(samples) == 0:
+                report[phase] = {"calls": 0}
+                continue
+            report[phase] = {"calls": len(samples), "total": float(samples.sum()), "max": float(samples.max())}
+            for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+                report[phase]["p" + str(percentile)] = float(value)
+        return report
+
+def case_name(case):
+    return "{engine}-{width}x{width}-{resources}r-{emergencies}e-{behaviour}-{dispatch_mode}".format(**case)
+
+def build_case(case):
+    graph_rng, agent_rng = graphs.simulation_generators(case["seed"])
+
+    graph = graphs.Graph('Off', graph_rng)
+    graph.generate_grid_graph(case["width"], case["width"])
+    graph.initial_setup(case["emergencies"], case["cycles"], case["distribution"])
+    graph.dispatch_mode = case["dispatch_mode"]
+
+    city_agent = agent.City_Agent(agent_rng)
+    city_agent.initial_setup(graph, case["resources"], case["behaviour"])
+    graph.city_agent = city_agent
+    return graph, city_agent
+
+def run_case(case):
+    timer = PhaseTimer()
+
+    start = time.perf_counter()
+    graph, city_agent = build_case(case)
+    setup_time = time.perf_counter() - start
+
+    # Same cycle logic as aasma.simulate, with every phase timed on its own
+    if case["engine"] == "Vector":
+        engine = vector_engine.VectorEngine(graph, city_agent)
+        timer.wrap(engine, "cycle_passed", "cycle_passed")
+        timer.wrap(engine, "generate_emergencies", "generate_emergencies")
+        timer.wrap(engine, "dispatch_resources", "dispatch_resources")
+        timer.wrap(engine, "dispatch_closest_emergencies", "dispatch_closest_emergency")
+        move_agents = engine.move_agents
+        active = lambda: engine.active_count
+    else:
+        timer.wrap(graph, "cycle_passed", "cycle_passed")
+        timer.wrap(graph, "generate_emergencies", "generate_emergencies")
+        timer.wrap(city_agent, "dispatch_resources", "dispatch_resources")
+        timer.wrap(city_agent, "dispatch_closest_emergency", "dispatch_closest_emergency")
+
+        def move_agents():
+            for agent_id in city_agent.resource_agents_list:
+                city_agent.resource_agents_list[agent_id].move_agent()
+
+        active = lambda: len(city_agent.active_emergencies)
+
+    cycle_count = 0
+    start = time.perf_counter()
+    while (cycle_count <= case["cycles"] or active() > 0) and (case["max_cycles"] == None or cycle_count < case["max_cycles"]):
+        if case["engine"] == "Vector":
+            engine.cycle_passed()
+        else:
+            graph.cycle_passed(cycle_count)
+        cycle_count += 1
+        timer.time("movement", move_agents)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "name": case_name(case),
+        "case": case,
+        "setup_time": setup_time,
+        "elapsed_time": elapsed,
+        "cycles": cycle_count,
+        "cycles_per_second": cycle_count / elapsed if elapsed > 0 else None,
+        "phases": timer.report(),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(results, baseline, threshold):
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+
+    for result in results:
+        if result["name"] not in baseline_cases:
+            continue
+        previous = baseline_cases[result["name"]]
+        if previous["cycles_per_second"] and result["cycles_per_second"] < previous["cycles_per_second"] * (1 - threshold):
+            regressions.append(result["name"] + ": cycles/sec " + str(round(previous["cycles_per_second"], 2)) + " -> " + str(round(result["cycles_per_second"], 2)))
+        if result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + threshold):
+            regressions.append(result["name"] + ": peak RSS " + str(round(previous["peak_rss_mb"], 1)) + " MB -> " + str(round(result["peak_rss_mb"], 1)) + " MB")
+    return regressions
+
+@click.command()
+@click.option('--preset', type=click.Choice(list(PRESETS)), default='quick', help='Set of grid sizes, fleets and emergency loads')
+@click.option('--case', 'cases', multiple=True, type=(int, int, int, int), help='Custom case as GRID_SIDE RESOURCES EMERGENCIES CYCLES, replaces the preset')
+@click.option('--engine', 'engines', multiple=True, type=click.Choice(['Object', 'Vector']), help='Engines to benchmark, both by default')
+@click.option('--behaviour', type=click.Choice(['Idle','Patrol','Station','Mix']), default='Mix', help='Agent behaviour')
+@click.option('--distribution', type=click.Choice(['Uniform', 'Normal', 'Linear', 'Exponential']), default='Uniform', help='Emergency distribution')
+@click.option('--dispatch-mode', type=click.Choice(['Greedy','Batch']), default='Greedy', help='Dispatch of idle agents')
+@click.option('--max-cycles', type=click.IntRange(min=1), default=None, help='Stop every case after this many cycles')
+@click.option('--seed', type=int, default=0, help='Seed of every case')
+@click.option('--output', type=click.File('w'), default='-', help='JSON result file, standard output by default')
+@click.option('--baseline', type=click.File('r'), default=None, help='Earlier JSON result to compare against')
+@click.option('--threshold', type=float, default=0.2, help='Relative slowdown or memory growth flagged as a regression')
+def benchmark(preset, cases, engines, behaviour, distribution, dispatch_mode, max_cycles, seed, output, baseline, threshold):
+    """Scaling benchmark of the simulator. Every case runs in its own process so that its peak RSS is measured alone,
+    and cycle_passed, generate_emergencies, dispatch_resources, dispatch_closest_emergency and agent movement are timed separately.\n
+    With --baseline, the exit status is 1 when a case regressed by more than --threshold."""
+    benchmark_cases = []
+    for width, resources, emergencies, cycles in cases or PRESETS[preset]:
+        for engine in engines or ['Object', 'Vector']:
+            benchmark_cases.append({"engine": engine, "width": width, "resources": resources, "emergencies": emergencies, "cycles": cycles,
+                "behaviour": behaviour, "distribution": distribution, "dispatch_mode": dispatch_mode, "max_cycles": max_cycles, "seed": seed})
+
+    results = []
+    for case in benchmark_cases:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run_case, case).result()
+        results.append(result)
+        click.echo(result["name"] + ": " + str(round(result["cycles_per_second"], 2)) + " cycles/sec, peak RSS " + str(round(result["peak_rss_mb"], 1)) + " MB", err=True)
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__, "cases": results}
+    output.write(json.dumps(report, indent=2) + "\n")
+
+    if baseline != None:
+        regressions = compare_results(results, json.load(baseline), threshold)
+        for regression in regressions:
+            click.echo("Regression " + regression, err=True)
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    benchmark()
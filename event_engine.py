@@ -0,0 +1,108 @@
+import numpy as np
+import events as events
+import vector_engine as vector_engine
+
+class EventEngine(vector_engine.VectorEngine):
+
+    def __init__(self, graph, city_agent):
+        super().__init__(graph, city_agent)
+
+        # Cycles in which at least one emergency is scheduled to appear
+        self.scheduled_cycles = np.flatnonzero(np.diff(graph.emergency_schedule_offsets))
+
+        self.patrolling = self.behaviours == vector_engine.PATROL
+        self.station_agents = self.behaviours == vector_engine.STATION
+
+        # Cycles jumped over instead of simulated
+        self.skipped_cycles = 0
+
+    def run(self, cycles):
+        cycle_count = self.current_cycle_count
+
+        # Steps one cycle at a time whenever something happens, and jumps straight
+        # to the next event while the state only counts time
+        while cycle_count <= cycles or self.active_count > 0:
+            skipped = self.quiet_cycles(cycles + 1 - cycle_count)
+            if skipped > 0:
+                self.skip_cycles(skipped)
+                cycle_count += skipped
+                continue
+
+            self.step()
+            cycle_count += 1
+
+        self.finish()
+        return cycle_count
+
+    def quiet_cycles(self, remaining):
+        # Dispatch would assign an agent
+        if len(self.unsatisfied) > 0 and len(self.available_order) > 0:
+            return 0
+
+        # Some agent would draw a random patrol step, or change position. Agents still saving up
+        # travel time for a long edge are away from their target too, so they also step
+        if np.any(self.available & self.patrolling):
+            return 0
+        assigned = ~self.available
+        if np.any(assigned & (self.positions != self.emergency_locations[np.maximum(self.emergencies, 0)])):
+            return 0
+        if np.any(self.available & self.station_agents & (self.positions != self.stations)):
+            return 0
+
+        # Candidate next events, the first one decides how far time can jump
+        next_events = []
+
+        position = np.searchsorted(self.scheduled_cycles, self.current_cycle_count)
+        if position < len(self.scheduled_cycles):
+            next_events.append(int(self.scheduled_cycles[position]) - self.current_cycle_count)
+
+        if self.active_count > 0:
+            # An emergency with agents on scene completes once its counter runs out
+            on_scene = np.bincount(self.emergencies[assigned], minlength=len(self.counts))
+            working = np.flatnonzero(self.active & (on_scene > 0))
+            if len(working) > 0:
+                next_events.append(int(np.min((self.counts[working] - 1) // on_scene[working])))
+        elif remaining > 0:
+            next_events.append(remaining)
+
+        if len(next_events) == 0:
+            return 0
+        return max(min(next_events), 0)
+
+    def skip_cycles(self, count):
+        instrumentation = self.graph.instrumentation
+
+        # The jump is timed as the first skipped cycle, the others take no time. Dispatch
+        # had nothing to do in any of them, which counts as zero time per cycle
+        instrumentation.begin_cycle()
+        phase_start = instrumentation.start()
+        self.graph.dispatch_times.add_repeated(0.0, count)
+
+        active = np.flatnonzero(self.active)
+        if len(active) > 0:
+            # Same updates as count calls of update_counters, nobody moves in between
+            occupancy = np.bincount(self.positions, minlength=len(self.node_list))
+            occupied = active[occupancy[self.emergency_locations[active]] > 0]
+            first_response = occupied[self.response_times[occupied] < 0]
+            self.response_times[first_response] = self.longevities[first_response] + 1
+            for emergency_id in first_response.tolist():
+                self.graph.events.record(self.current_cycle_count, events.FIRST_ARRIVAL, emergency_id, -1, int(self.emergency_locations[emergency_id]), int(self.response_times[emergency_id]))
+
+            self.longevities[active] += count
+
+            # Every assigned agent is on scene and every one of them works
+            assisting = np.flatnonzero(self.emergencies >= 0)
+            self.dispatch_times[assisting] += count
+            self.counts -= count * np.bincount(self.emergencies[assisting], minlength=len(self.counts))
+
+        # Station agents at rest take a new arrival order each cycle, after everyone else
+        resting = np.flatnonzero(self.available & self.station_agents)
+        self.arrivals[resting] = self.arrival_count + np.arange(len(resting))
+        self.arrival_count += len(resting)
+
+        self.current_cycle_count += count
+        self.skipped_cycles += count
+
+        instrumentation.stop("skip", phase_start)
+        instrumentation.end_cycle()
+        instrumentation.idle_cycles(count - 1)
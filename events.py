@@ -0,0 +1,135 @@
+import json
+import math
+import os
+import numpy as np
+
+# Event kinds, stored as small integer codes
+EMERGENCY_CREATED = 0
+DISPATCHED = 1
+FIRST_ARRIVAL = 2
+RESOLVED = 3
+RELEASED = 4
+EVENT_NAMES = ["emergency_created", "dispatched", "first_arrival", "resolved", "released"]
+
+# One fixed-size record per event. Unused fields are -1, and value depends on the kind:
+# emergency type on creation, route length on dispatch (a travel time, fractional on weighted
+# road networks), response time on first arrival, longevity on resolution and cycles worked on release
+# Within a cycle, records follow the simulation: dispatches of idle agents, then every active emergency
+# in id order with its first arrival, resolution and the releases of its agents, then new emergencies
+# with their dispatches. Every engine writes this same order
+EVENT_DTYPE = np.dtype([("cycle", np.int32), ("event", np.int8), ("emergency", np.int32), ("agent", np.int32), ("node", np.int32), ("value", np.float64)])
+
+FORMATS = [".jsonl", ".npy", ".parquet"]
+
+def as_value(number):
+    if number == None or number == math.inf:
+        return -1
+    return float(number)
+
+class EventLog:
+
+    enabled = True
+
+    def __init__(self, path, chunk_size=65536):
+
+        # The file extension selects JSON lines, a NumPy structured array or Parquet
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower()
+        if self.format not in FORMATS:
+            raise ValueError("Event log must end in one of " + ", ".join(FORMATS) + ": " + path)
+
+        # Events are kept as tuples and converted to EVENT_DTYPE once per chunk
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.count = 0
+
+        self.writer = None
+        if self.format == ".parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ValueError("Parquet event logs require pyarrow (pip install pyarrow): " + path)
+            self.writer = pyarrow.parquet.ParquetWriter(path, pyarrow.schema([(name, pyarrow.from_numpy_dtype(EVENT_DTYPE[name])) for name in EVENT_DTYPE.names]))
+        elif self.format == ".npy":
+            self.file = open(path, "wb")
+            write_npy_header(self.file, 0)
+        else:
+            self.file = open(path, "w")
+
+    def record(self, cycle, event, emergency=-1, agent=-1, node=-1, value=-1):
+        self.buffer.append((cycle, event, emergency, agent, node, value))
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        chunk = np.array(self.buffer, dtype=EVENT_DTYPE)
+        self.count += len(chunk)
+        self.buffer = []
+
+        if self.format == ".parquet":
+            import pyarrow
+            self.writer.write_table(pyarrow.table({name: chunk[name] for name in EVENT_DTYPE.names}))
+        elif self.format == ".npy":
+            self.file.write(chunk.tobytes())
+        else:
+            lines = []
+            for cycle, event, emergency, agent, node, value in chunk.tolist():
+                lines.append(json.dumps({"cycle": cycle, "event": EVENT_NAMES[event], "emergency": emergency, "agent": agent, "node": node, "value": value}))
+            self.file.write("\n".join(lines) + "\n")
+
+    def close(self):
+        self.flush()
+        if self.format == ".parquet":
+            self.writer.close()
+        else:
+            if self.format == ".npy":
+                # The header holds the final event count
+                self.file.seek(0)
+                write_npy_header(self.file, self.count)
+            self.file.close()
+        return self.count
+
+class NullEventLog:
+
+    enabled = False
+
+    def record(self, cycle, event, emergency=-1, agent=-1, node=-1, value=-1):
+        pass
+
+    def close(self):
+        return 0
+
+# Shared instance used whenever no event log is set
+DISABLED = NullEventLog()
+
+# Fixed header size, so the header can be rewritten in place once the count is known
+NPY_HEADER_SIZE = 256
+
+def write_npy_header(npy_file, count):
+    header = repr({"descr": np.lib.format.dtype_to_descr(EVENT_DTYPE), "fortran_order": False, "shape": (count,)})
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    npy_file.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1"))
+
+# Reads an event log back as an EVENT_DTYPE array, memory mapped for .npy files
+def load_events(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        return np.load(path, mmap_mode="r")
+    if extension == ".parquet":
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path)
+        events = np.empty(table.num_rows, dtype=EVENT_DTYPE)
+        for name in EVENT_DTYPE.names:
+            events[name] = table.column(name).to_numpy()
+        return events
+
+    codes = {name: code for code, name in enumerate(EVENT_NAMES)}
+    records = []
+    with open(path) as log_file:
+        for line in log_file:
+            event = json.loads(line)
+            records.append((event["cycle"], codes[event["event"]], event["emergency"], event["agent"], event["node"], event["value"]))
+    return np.array(records, dtype=EVENT_DTYPE)
@@ -1,11 +1,18 @@
 import numpy as np
 import networkx as nx 
-import matplotlib.pyplot as plt
 from scipy.stats import truncnorm
 from scipy.stats import truncexpon
 import click as click
 import math
+import time
+import bisect
 import agent_system as agent
+import routing as routing
+import grid as grid
+import instrumentation as instrumentation
+import renderer as renderer
+import events as events
+import metrics as metrics
 
 def get_truncated_normal(mean=0, sd=1, low=0, upp=10):
     return truncnorm((low - mean) / sd, (upp - mean) / sd, loc=mean, scale=sd)
@@ -13,27 +20,52 @@ def get_truncated_normal(mean=0, sd=1, low=0, upp=10):
 def get_truncated_exponential(lower=0, upper=1000, scale=0.5):
     return truncexpon(b=(upper-lower)/scale, loc=lower, scale=scale)
 
+# Range of the internal counter of each emergency type
+EMERGENCY_DURATIONS = {1: (4, 8), 2: (10, 15), 3: (25, 35), 4: (55, 70), 5: (100, 150)}
+
+def random_emergency_count(emergency_type, rng):
+    low, high = EMERGENCY_DURATIONS.get(emergency_type, EMERGENCY_DURATIONS[5])
+    return int(rng.integers(low, high + 1))
+
+def simulation_generators(seed=None):
+    # Independent streams for the graph (emergencies, positions) and the agents (behaviours, patrols)
+    graph_sequence, agent_sequence = np.random.SeedSequence(seed).spawn(2)
+    return np.random.default_rng(graph_sequence), np.random.default_rng(agent_sequence)
+
 class GraphNode:
 
+    # Emergency color per type, shared by every node
+    color_scale = ["#FCFF33", "#FFDA33", "#FF9F33", "#FF6433", "#FF3333"]
+
+    __slots__ = ("location", "index", "emergency", "color", "current_resources", "on_scene", "free_pool")
+
     def __init__(self):
 
-        # Location of node
+        # Location of node and its integer index in the graph
         self.location = None
+        self.index = None
 
         # status of active emergency in location
         self.emergency = None
 
         # Node color
         self.color = "grey"
-        self.color_scale = ["#FCFF33", "#FFDA33", "#FF9F33", "#FF6433", "#FF3333"]
 
         # Current resources in this location
         self.current_resources = {}
 
+        # Resources working on the emergency of this location, as (arrival, resource) in order of arrival
+        self.on_scene = []
+
+        # Pool of nodes without an active emergency
+        self.free_pool = None
+
 
     def activate_emergency(self, emergency):
         self.emergency = emergency
         self.color = self.color_scale[emergency.type-1]
+        if self.free_pool != None:
+            self.free_pool.remove(self.index)
 
     def is_emergency_active(self):
         if self.emergency != None:
@@ -43,6 +75,9 @@ class GraphNode:
     def delete_emergency(self):
         self.emergency = None
         self.color = "grey"
+        self.on_scene = []
+        if self.free_pool != None:
+            self.free_pool.add(self.index)
 
     def remove_resource(self, resource_id):
         del self.current_resources[resource_id]
@@ -50,52 +85,185 @@ class GraphNode:
     def add_resource(self, resource_id, resource):
         self.current_resources[resource_id] = resource
 
+    def add_on_scene(self, resource):
+        bisect.insort(self.on_scene, (resource.arrival, resource))
+
     def operating_resources(self, count):
         if len(self.current_resources) == 0:
             return None
-        for resource in self.current_resources:
-            if self.current_resources[resource].currently_assisting():
-                count -=1
-                self.current_resources[resource].dispatch_time += 1
-                if count <= 0:
-                    break
+        for arrival, resource in self.on_scene:
+            count -=1
+            resource.dispatch_time += 1
+            if count <= 0:
+                break
         return count
 
+# Drawn color of a node by the type of its emergency, 0 without one
+NODE_COLORS = np.array(["grey"] + GraphNode.color_scale, dtype=object)
+
+class NodePool:
+
+    def __init__(self, nodes, rng):
+
+        # Random generator used to sample the pool
+        self.rng = rng
+
+        # Pooled node indices occupy the first size positions of the array
+        self.nodes = np.array(nodes, dtype=np.int64)
+        self.positions = np.empty(len(self.nodes), dtype=np.int64)
+        self.positions[self.nodes] = np.arange(len(self.nodes))
+        self.size = len(self.nodes)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, node):
+        return self.positions[node] < self.size
+
+    def remove(self, node):
+        position = self.positions[node]
+        if position >= self.size:
+            return
+        self.size -= 1
+        self.swap(position, self.size)
+
+    def add(self, node):
+        position = self.positions[node]
+        if position < self.size:
+            return
+        self.swap(position, self.size)
+        self.size += 1
+
+    def swap(self, i, j):
+        node_i = self.nodes[i]
+        node_j = self.nodes[j]
+        self.nodes[i] = node_j
+        self.nodes[j] = node_i
+        self.positions[node_j] = i
+        self.positions[node_i] = j
+
+    def restore(self, nodes, size):
+        # Same pooled nodes in the same order, so sampling continues exactly as before
+        self.nodes = np.array(nodes, dtype=np.int64)
+        self.positions[self.nodes] = np.arange(len(self.nodes))
+        self.size = size
+
+    def sample(self):
+        if self.size == 0:
+            return None
+        return int(self.nodes[self.rng.integers(self.size)])
+
+class GraphNodes:
+
+    def __init__(self, node_list, free_pool):
+
+        # GraphNode of every node by index, only created the first time a node is used
+        self.node_list = node_list
+        self.free_pool = free_pool
+        self.created = {}
+
+    def __len__(self):
+        return len(self.node_list)
+
+    def __getitem__(self, index):
+        graph_node = self.created.get(index)
+        if graph_node == None:
+            graph_node = GraphNode()
+            graph_node.location = self.node_list[index]
+            graph_node.index = index
+            graph_node.free_pool = self.free_pool
+            self.created[index] = graph_node
+        return graph_node
+
+    def __iter__(self):
+        # Nodes never used hold no state, only the created ones are visited, in index order
+        for index in sorted(self.created):
+            yield self.created[index]
+
 class Graph:
 
-    def __init__(self, visualization):
+    def __init__(self, visualization, rng=None):
+
+        # Random generator for emergencies and positions
+        self.rng = np.random.default_rng(rng)
+
+        # The graph stucture, built on first use for grids
+        self.network = None
 
-        # The graph stucture 
-        self.graph = None
+        # Next-hop and distance tables over the graph, with the edge attribute holding travel
+        # times and the number of per-destination shortest-path trees kept on large graphs
+        self.routing = None
+        self.routing_weight = "weight"
+        self.routing_cache_size = 256
+
+        # Bumped whenever the routing is rebuilt, so routes stored by agents know they are stale
+        self.routing_version = 0
+
+        # List of all nodes, their integer indices and pool of nodes without an active emergency
+        self.node_list = []
+        self.node_index = {}
+        self.free_nodes = None
+
+        # GraphNode of every node, emergency type of every node (0 without one) and neighbours, by node index
+        self.graph_nodes = []
+        self.node_emergency_types = np.zeros(0, dtype=np.int8)
+        self.neighbours = None
+
+        # Grid dimensions, kept once its roads change so the city is still drawn on the grid
+        self.grid_width = None
+        self.grid_height = None
 
         # City agent
         self.city_agent = None
 
-        # Color map for the graph nodes
-        self.color_map = []
+        # Resources entered into any node so far, stamps the order of arrival of each resource
+        self.arrival_count = 0
+
+        # Resources on every node by node index, and indices whose count changed since the last frame
+        self.occupancy = np.zeros(0, dtype=np.int64)
+        self.occupancy_changes = set()
+
+        # Indices of nodes whose emergency color changed since the last drawn frame
+        self.changed_nodes = set()
 
         # Attributes reffering to emergencies
         self.total_emergencies = 0
         self.emergency_count = 0
         self.active_emergencies_list = {}
 
-        # Predefined emergency list 
-        self.emergency_cycle_list = []
+        # Predefined emergency schedule, types grouped by cycle with
+        # the emergencies of cycle c in types[offsets[c]:offsets[c+1]]
+        self.emergency_schedule_offsets = np.zeros(1, dtype=np.int64)
+        self.emergency_schedule_types = np.zeros(0, dtype=np.int8)
+
+        # Per-phase timings, disabled unless set_instrumentation is called
+        self.instrumentation = instrumentation.DISABLED
+
+        # Structured log of emergencies and dispatches, disabled unless set_event_log is called
+        self.events = events.DISABLED
+
+        # Dispatch of idle agents, Greedy or Batch, and running statistics of its time per cycle
+        self.dispatch_mode = "Greedy"
+        self.dispatch_times = metrics.RunningStats()
 
         # Cycle count
         self.total_cycles = 0
         self.current_cycle_count = 0
 
-        # Width and Height for visualization
+        # Width and Height for visualization, and (N, 2) drawing coordinates by node index
         self.draw_width = 10
         self.draw_height = 10
-        self.node_positions = {}
+        self.node_positions = None
         self.draw_interval = 0.05
 
-        self.figure = None
-        self.axis = None
-        self.axis_index_1 = None
-        self.axis_index_2 = None
+        # Persistent artists of the visualization, redrawn every frame_skip cycles
+        self.renderer = None
+        self.frame_skip = 1
+        self.drawn_occupancy = np.zeros(0, dtype=np.int64)
+
+        # Offline recorder fed with the same frame changes, see recording.FrameRecorder
+        self.recorder = None
+
         self.exec_type = None
         self.behaviour = None
         self.distribution = None
@@ -114,204 +282,367 @@ class Graph:
         if visualization == 'Off':
             self.visualization = False
 
-    def initial_setup(self, emergencies, cycles):
+    def initial_setup(self, emergencies, cycles, distribution="Uniform"):
         self.total_emergencies = emergencies
         self.total_cycles = cycles
-        self.uniform_emergency_distribution()
-        self.draw_interval = 10/self.total_cycles
-
-    def initial_setup_simulation(self, simul_type):
-        self.generate_grid_graph(self.simulation_width, self.simulation_height)
-        self.total_emergencies = self.simulation_emergencies
-        self.total_cycles = self.simulation_cycles
+        self.distribution = distribution
 
-        if simul_type == "Uniform":
+        if distribution == "Uniform":
             self.uniform_emergency_distribution()
-        elif simul_type == "Normal":
+        elif distribution == "Normal":
             self.normal_emergency_distribution()
-        elif simul_type == "Linear":
+        elif distribution == "Linear":
             self.linear_emergency_distribution()
-        elif simul_type == "Exponential":
+        elif distribution == "Exponential":
             self.exponential_emergency_distribution()
 
+        self.draw_interval = 10/self.total_cycles
+
+    def initial_setup_simulation(self, simul_type):
+        self.generate_grid_graph(self.simulation_width, self.simulation_height)
+        self.initial_setup(self.simulation_emergencies, self.simulation_cycles, simul_type)
+        self.draw_interval = 0.05
+
         return [self.simulation_resources, self.simulation_emergencies, self.simulation_cycles, self.simulation_width*self.simulation_height]
 
     def cycle_passed(self, cycle_count):
+        instrumentation = self.instrumentation
+
+        dispatch_start = time.perf_counter()
+        phase_start = instrumentation.start()
 
-        available_agents = dict(self.city_agent.available_agents)
-        unsatisfied_emergencies = self.city_agent.unsatisfied_emergencies
+        if self.dispatch_mode == "Batch":
+            self.city_agent.dispatch_batch()
+        else:
+            available_agents = dict(self.city_agent.available_agents)
+            unsatisfied_emergencies = self.city_agent.unsatisfied_emergencies
 
-        for agent_id in available_agents:
-            if len(unsatisfied_emergencies) > 0:
-                self.city_agent.dispatch_closest_emergency(available_agents[agent_id])
-                
+            for agent_id in available_agents:
+                if len(unsatisfied_emergencies) > 0:
+                    self.city_agent.dispatch_closest_emergency(available_agents[agent_id])
+
+        self.dispatch_times.add(time.perf_counter() - dispatch_start)
+        instrumentation.stop("dispatch", phase_start)
+
+        phase_start = instrumentation.start()
         emergency_list = list(self.active_emergencies_list)
         for emergency in emergency_list:
+            responded = self.active_emergencies_list[emergency].response_time != None
             result = self.active_emergencies_list[emergency].update_counter()
 
+            if not responded and self.active_emergencies_list[emergency].response_time != None:
+                current = self.active_emergencies_list[emergency]
+                self.events.record(self.current_cycle_count, events.FIRST_ARRIVAL, current.id, -1, self.node_index[current.location], current.response_time)
+
             if not result:
                 self.delete_emergency(self.active_emergencies_list[emergency])
+        instrumentation.stop("emergency_updates", phase_start)
 
+        phase_start = instrumentation.start()
         self.generate_emergencies()
+        instrumentation.stop("emergency_generation", phase_start)
         self.current_cycle_count+= 1
 
-        if self.visualization:
+        if (self.visualization or self.recorder != None) and self.current_cycle_count % self.frame_skip == 0:
+            phase_start = instrumentation.start()
             self.draw_graph()
+            instrumentation.stop("draw_graph", phase_start)
 
     def remove_resource(self, current_location, resource_id):
-        self.graph.nodes[current_location]["node"].remove_resource(resource_id)
+        self.remove_resource_by_index(self.node_index[current_location], resource_id)
 
+    def remove_resource_by_index(self, index, resource_id):
+        self.occupancy[index] -= 1
+        self.occupancy_changes.add(index)
+        self.graph_nodes[index].remove_resource(resource_id)
 
     def add_resource(self, next_location, resource_id, resource):
-        self.graph.nodes[next_location]["node"].add_resource(resource_id, resource)
+        self.add_resource_by_index(self.node_index[next_location], resource_id, resource)
+
+    def add_resource_by_index(self, index, resource_id, resource):
+        resource.arrival = self.arrival_count
+        self.arrival_count += 1
+        self.occupancy[index] += 1
+        self.occupancy_changes.add(index)
+        self.graph_nodes[index].add_resource(resource_id, resource)
+
+    def add_on_scene(self, index, resource):
+        self.graph_nodes[index].add_on_scene(resource)
 
     def delete_emergency(self, emergency):
+        self.events.record(self.current_cycle_count, events.RESOLVED, emergency.id, -1, emergency.node.index, emergency.longevity)
         self.city_agent.delete_emergency(emergency)
+        self.changed_nodes.add(emergency.node.index)
+        self.node_emergency_types[emergency.node.index] = 0
         self.active_emergencies_list[emergency.id].delete_self()
         del self.active_emergencies_list[emergency.id]
         
 
     def generate_emergencies(self):
-        while self.emergency_cycle_list and self.emergency_cycle_list[0][0] == self.current_cycle_count:
+        cycle = self.current_cycle_count
+        if cycle >= len(self.emergency_schedule_offsets) - 1:
+            return
+
+        start = self.emergency_schedule_offsets[cycle]
+        end = self.emergency_schedule_offsets[cycle + 1]
+
+        for emergency_type in self.emergency_schedule_types[start:end].tolist():
             new_emergency = Emergency()
             emergency_id = self.emergency_count
             location = self.random_graph_free_emergency_position()
-            emergency_type = self.emergency_cycle_list[0][1]
 
             if location != None:
-                node = self.graph.nodes[location]["node"]
-                new_emergency.initial_setup(emergency_id, location, emergency_type, node)
+                node = self.graph_nodes[self.node_index[location]]
+                new_emergency.initial_setup(emergency_id, location, emergency_type, node, self.rng)
 
                 self.emergency_count += 1 
                 self.active_emergencies_list[emergency_id] = new_emergency
 
                 node.activate_emergency(new_emergency)
+                self.changed_nodes.add(node.index)
+                self.node_emergency_types[node.index] = emergency_type
+                self.events.record(cycle, events.EMERGENCY_CREATED, emergency_id, -1, node.index, emergency_type)
                 self.city_agent.register_emergency(new_emergency)
 
-            self.emergency_cycle_list = self.emergency_cycle_list[1:]
+    @property
+    def graph(self):
+        # Grids only build their networkx graph once an export or an edge change needs it
+        if self.network == None and self.grid_width != None:
+            self.network = nx.grid_2d_graph(self.grid_width, self.grid_height)
+        return self.network
 
-    def generate_grid_graph(self, width, height):
-        self.graph = nx.grid_2d_graph(width,height)
+    @graph.setter
+    def graph(self, graph):
+        self.network = graph
 
-        row_padding = self.draw_width / width
-        column_padding = self.draw_height / height
-
-        for node in self.graph:
-            self.graph.nodes[node]["node"] = GraphNode()
-            self.node_positions[node] = np.array([node[0]*row_padding, node[1]*column_padding])
+    def generate_grid_graph(self, width, height):
+        self.network = None
+        self.grid_width = width
+        self.grid_height = height
+
+        self.setup_nodes(grid.GridNodes(width, height), grid.GridIndex(width, height))
+        self.node_positions = None
+
+        self.build_routing()
+
+    def edge_count(self):
+        if self.network == None and self.grid_width != None:
+            return grid.edge_count(self.grid_width, self.grid_height)
+        return self.network.number_of_edges()
+
+    def load_road_network(self, path, weight="weight", cache_size=256):
+        if path.endswith(".graphml"):
+            network = nx.read_graphml(path)
+        else:
+            # Edge list of "u v" or "u v travel_time" lines
+            network = nx.read_edgelist(path, data=[(weight, float)])
+
+        # Roads are traversed both ways, parallel roads keep their fastest travel time
+        graph = nx.Graph()
+        for u, v, data in network.edges(data=True):
+            travel_time = float(data.get(weight, 1))
+            if u == v:
+                continue
+            if not graph.has_edge(u, v) or travel_time < graph.edges[u, v][weight]:
+                graph.add_edge(u, v, **{weight: travel_time})
+
+        # Agents and emergencies only live on the largest connected part of the network
+        component = max(nx.connected_components(graph), key=len)
+        if len(component) < graph.number_of_nodes():
+            graph = graph.subgraph(component).copy()
+        self.set_road_network(graph, weight, cache_size)
+
+        # Coordinates from the file when present, scaled to the drawing area
+        if all("x" in network.nodes[node] and "y" in network.nodes[node] for node in self.node_list):
+            coordinates = np.array([[float(network.nodes[node]["x"]), float(network.nodes[node]["y"])] for node in self.node_list])
+            coordinates -= coordinates.min(axis=0)
+            coordinates /= np.maximum(coordinates.max(axis=0), 1e-12)
+            self.node_positions = coordinates * [self.draw_width, self.draw_height]
+
+    def set_road_network(self, graph, weight="weight", cache_size=256):
+        self.graph = graph
+        self.grid_width = None
+        self.grid_height = None
+        self.routing_weight = weight
+        self.routing_cache_size = cache_size
+
+        node_list = list(graph.nodes)
+        self.setup_nodes(node_list, {node: i for i, node in enumerate(node_list)})
+        self.node_positions = None
+
+        self.build_routing()
+
+    def setup_nodes(self, node_list, node_index):
+        self.node_list = node_list
+        self.node_index = node_index
+        self.free_nodes = NodePool(np.arange(len(node_list)), self.rng)
+        self.graph_nodes = GraphNodes(node_list, self.free_nodes)
+        self.node_emergency_types = np.zeros(len(node_list), dtype=np.int8)
+        self.occupancy = np.zeros(len(node_list), dtype=np.int64)
+        self.occupancy_changes = set()
+        self.drawn_occupancy = np.zeros(len(node_list), dtype=np.int64)
+
+    def drawing_positions(self):
+        # Grids are placed from their coordinates, networks without coordinates
+        # are laid out only once something is drawn
+        if self.node_positions is None:
+            if self.grid_width != None:
+                self.node_positions = grid.drawing_positions(self.grid_width, self.grid_height, self.draw_width, self.draw_height)
+            else:
+                layout = nx.spring_layout(self.graph, seed=0)
+                self.node_positions = (np.array([layout[node] for node in self.node_list]).reshape(-1, 2) + 1) / 2 * [self.draw_width, self.draw_height]
+        return self.node_positions
+
+    def edge_indices(self):
+        if self.network == None and self.grid_width != None:
+            return grid.edge_indices(self.grid_width, self.grid_height)
+        return np.array([(self.node_index[u], self.node_index[v]) for u, v in self.graph.edges], dtype=np.int64).reshape(-1, 2)
+
+    def is_unmodified_grid(self):
+        # A grid that was never materialised is unmodified by construction
+        return self.grid_width != None and (self.network == None or routing.is_unmodified_grid(self.network, self.grid_width, self.grid_height, self.routing_weight))
+
+    def build_routing(self):
+        # Only an unmodified grid routes in closed form, a modified one falls back to the tables
+        if self.is_unmodified_grid():
+            self.routing = routing.GridRouting(self.grid_width, self.grid_height)
+            self.neighbours = routing.GridNeighbours(self.grid_width, self.grid_height)
+        else:
+            self.routing = routing.RoutingTable(self.graph, cache_size=self.routing_cache_size, weight=self.routing_weight)
+            indptr, indices, _ = routing.adjacency_arrays(self.graph, self.node_index)
+            self.neighbours = routing.Neighbours(indptr, indices)
+        self.routing = self.instrumentation.wrap_routing(self.routing)
+        self.routing_version += 1
+
+    def set_event_log(self, event_log):
+        self.events = event_log
+
+    def set_instrumentation(self, instrumentation):
+        self.instrumentation = instrumentation
+        self.routing = instrumentation.wrap_routing(self.routing)
+
+    def remove_edge(self, u, v):
+        self.graph.remove_edge(u, v)
+
+        # Patrols waiting to cross the removed edge draw another neighbour
+        for node, other in ((u, v), (v, u)):
+            for resource in self.graph_nodes[self.node_index[node]].current_resources.values():
+                if resource.patrol_target == self.node_index[other]:
+                    resource.patrol_target = -1
+        self.build_routing()
+
+    def set_edge_weight(self, u, v, weight):
+        self.graph.edges[u, v][self.routing_weight] = weight
+        self.build_routing()
             
     def end_visualize_graph(self):
-        plt.close()
+        if self.visualization and self.renderer != None:
+            self.renderer.close()
+            self.renderer = None
 
     def visualize_graph(self):
         if self.visualization:
-            self.figure = plt.figure(figsize=(2*self.draw_width,self.draw_height))
-            plt.ion()
-            plt.show()
-            figure, self.axis = plt.subplots(1, 2, num = 1)
-            self.node_count = self.simulation_width*self.simulation_height
-
-            figure.suptitle(str(self.exec_type)+" with "+str(self.node_count)+" Nodes - current cycle "+str(self.current_cycle_count+1), fontsize=25)
-            figure.text(0.18, 0.10, "Emergency distribution: "+self.distribution, fontsize=20)
-            figure.text(0.66, 0.10, "Agent behaviour: "+self.behaviour, fontsize=20)
-            figure.text(0.24, 0.04, "Total Resources: "+str(self.simulation_resources)+",    Total Emergencies: "+str(self.total_emergencies)+",    Total Cycles: "+str(self.total_cycles), fontsize=20)
-            self.axis_index_1 = np.unravel_index(0,self.axis.shape)
-            self.axis_index_2 = np.unravel_index(1,self.axis.shape)
-
-            self.axis[self.axis_index_1].set_title("Active emergencies", fontsize=25)
-            self.axis[self.axis_index_1].set_xlabel("Emergency distribution: "+self.distribution,fontsize=20)
-            self.axis[self.axis_index_1].set_axis_off()
-
-            self.axis[self.axis_index_2].set_title("Resource distribution per location", fontsize=25)
-            self.axis[self.axis_index_2].set_xlabel("Agent behaviour: "+self.behaviour,fontsize=20)
-            self.axis[self.axis_index_2].set_axis_off()
-
-    def draw_graph(self):
-        self.color_map = []
-        resources_locations = self.city_agent.get_resources_locations()
-        draw_locations = {}
-        node_colors = []
-        self.axis[self.axis_index_1].clear()
-        self.axis[self.axis_index_2].clear()
+            self.renderer = renderer.GraphRenderer(self.drawing_positions(), self.edge_indices(), self.frame_titles())
+            self.reset_frame_changes()
+
+    def frame_titles(self):
+        self.node_count = self.simulation_width*self.simulation_height
+        return {
+            "title": self.frame_title(self.current_cycle_count+1),
+            "distribution": self.distribution,
+            "behaviour": self.behaviour,
+            "resources": self.simulation_resources,
+            "emergencies": self.total_emergencies,
+            "cycles": self.total_cycles,
+            "width": self.draw_width,
+            "height": self.draw_height,
+        }
+
+    def frame_title(self, cycle):
+        return str(self.exec_type)+" with "+str(self.node_count)+" Nodes - current cycle "+str(cycle)
+
+    def reset_frame_changes(self):
+        # Everything present before the first frame is drawn as a change
+        self.changed_nodes = set(range(len(self.node_list)))
+        self.occupancy_changes = set(range(len(self.node_list)))
+        self.drawn_occupancy = np.zeros(len(self.node_list), dtype=np.int64)
+
+    def start_recording(self, recorder):
+        self.recorder = recorder
+        if not self.visualization:
+            self.reset_frame_changes()
+
+    def stop_recording(self):
+        if self.recorder == None:
+            return None
+        output = self.recorder.close()
+        self.recorder = None
+        return output
 
-        self.figure.suptitle(str(self.exec_type)+" with "+str(self.node_count)+" Nodes - current cycle "+str(self.current_cycle_count), fontsize=25)
+    def frame_changes(self):
+        # Only nodes whose emergency color or resource count changed since the last frame, by node index
+        changed = np.fromiter(self.changed_nodes, dtype=np.int64, count=len(self.changed_nodes))
+        self.changed_nodes = set()
+        color_changes = dict(zip(changed.tolist(), NODE_COLORS[self.node_emergency_types[changed]].tolist()))
 
-        self.axis[self.axis_index_1].set_title("Active emergencies", fontsize=20)
-        self.axis[self.axis_index_1].set_axis_off()
-        
+        # Nodes a resource entered or left, kept only if the count differs from the drawn one
+        moved = np.fromiter(self.occupancy_changes, dtype=np.int64, count=len(self.occupancy_changes))
+        self.occupancy_changes = set()
+        moved = moved[self.occupancy[moved] != self.drawn_occupancy[moved]]
+        self.drawn_occupancy[moved] = self.occupancy[moved]
+        count_changes = dict(zip(moved.tolist(), self.occupancy[moved].tolist()))
 
-        self.axis[self.axis_index_2].set_title("Resource distribution per location",fontsize=20)
-        self.axis[self.axis_index_2].set_axis_off()
-
-        for node in self.graph:
-            self.color_map.append(self.graph.nodes[node]["node"].color)
-            if node not in resources_locations:
-                    draw_locations[node] = ""
-                    node_colors.append("grey")
-            else:
-                draw_locations[node] = resources_locations[node]
-                node_colors.append("#89cff0")
-        
-        plt.sca(self.axis[self.axis_index_1])
-        nx.draw_networkx(self.graph, pos=self.node_positions, with_labels=False, node_color=self.color_map, ax=self.axis[self.axis_index_1])
+        return color_changes, count_changes
 
+    def draw_graph(self):
+        color_changes, count_changes = self.frame_changes()
 
-        plt.sca(self.axis[self.axis_index_2])
-        nx.draw_networkx(self.graph, pos=self.node_positions, with_labels=True, node_color = node_colors, node_shape = "s",labels=draw_locations, font_size = 20, font_weight = "bold", ax=self.axis[self.axis_index_2])
+        if self.recorder != None:
+            self.recorder.record(self.current_cycle_count, color_changes, count_changes)
 
-        plt.draw()
-        plt.pause(self.draw_interval)
+        if self.renderer != None:
+            self.renderer.update(self.frame_title(self.current_cycle_count), color_changes, count_changes)
+            self.renderer.present(self.draw_interval)
 
     def random_graph_position(self):
-        shuffled_nodes = list(self.graph.nodes)
-        np.random.shuffle(shuffled_nodes)
-        return shuffled_nodes[0]
+        return self.node_list[self.rng.integers(len(self.node_list))]
 
     def random_graph_free_emergency_position(self):
-        shuffled_nodes = list(self.graph.nodes)
-        np.random.shuffle(shuffled_nodes)
-        for node in shuffled_nodes:
-            if not self.graph.nodes[node]["node"].is_emergency_active():
-                return node
-        return None
+        index = self.free_nodes.sample()
+        if index == None:
+            return None
+        return self.node_list[index]
 
-    def random_emergency_grade_normal(self):
-        return np.random.choice([1,2,3,4,5], p=[0.30, 0.25, 0.20, 0.15, 0.10])
+    def random_emergency_grades_normal(self, size):
+        return self.rng.choice(np.array([1,2,3,4,5], dtype=np.int8), size=size, p=[0.30, 0.25, 0.20, 0.15, 0.10])
 
-    def uniform_emergency_distribution(self):
-        distribution = np.sort(np.random.random_integers(0, self.total_cycles-1, self.total_emergencies))
+    def schedule_emergencies(self, cycles):
+        cycles = np.sort(np.rint(cycles).astype(np.int64))
+        self.emergency_schedule_types = self.random_emergency_grades_normal(len(cycles))
 
-        for cycle in distribution:
-            self.emergency_cycle_list.append((cycle,self.random_emergency_grade_normal()))
+        per_cycle = np.bincount(cycles, minlength=self.total_cycles)
+        self.emergency_schedule_offsets = np.concatenate(([0], np.cumsum(per_cycle)))
 
-    def normal_emergency_distribution(self):
-        distribution = np.sort(get_truncated_normal(self.total_cycles/2,self.total_cycles/3, 0, self.total_cycles-1).rvs(self.total_emergencies))
+    def uniform_emergency_distribution(self):
+        self.schedule_emergencies(self.rng.integers(0, self.total_cycles, self.total_emergencies))
 
-        for cycle in distribution:
-            self.emergency_cycle_list.append((int(round(cycle)),self.random_emergency_grade_normal()))
+    def normal_emergency_distribution(self):
+        self.schedule_emergencies(get_truncated_normal(self.total_cycles/2,self.total_cycles/3, 0, self.total_cycles-1).rvs(self.total_emergencies, random_state=self.rng))
 
     def linear_emergency_distribution(self):
-        distribution = list(np.sort(np.random.triangular(0, self.total_cycles-1,self.total_cycles-1, self.total_emergencies)))
-
-        for cycle in distribution:
-            self.emergency_cycle_list.append((int(round(cycle)),self.random_emergency_grade_normal()))
+        self.schedule_emergencies(self.rng.triangular(0, self.total_cycles-1,self.total_cycles-1, self.total_emergencies))
 
     def exponential_emergency_distribution(self):
-        distribution = np.sort(get_truncated_exponential(0, self.total_cycles-1, self.total_cycles/32).rvs(self.total_emergencies))
-
-        distribution2 = []
-        for element in distribution:
-            distribution2.append(self.total_cycles-1-element)
-        distribution2 = np.sort(distribution2)
-
-        for cycle in distribution2:
-            self.emergency_cycle_list.append((int(round(cycle)),self.random_emergency_grade_normal()))
+        distribution = get_truncated_exponential(0, self.total_cycles-1, self.total_cycles/32).rvs(self.total_emergencies, random_state=self.rng)
+        self.schedule_emergencies(self.total_cycles-1-distribution)
 
     def debug_log(self):
         return self.graph.nodes
 
 class Emergency:
 
+    __slots__ = ("id", "location", "node", "type", "active", "longevity", "response_time", "count")
+
     def __init__(self):
         # Emergency identifier
         self.id = None
@@ -337,23 +668,14 @@ class Emergency:
         #Internal Counter
         self.count = 0
 
-    def initial_setup(self, id, location, emergency_type, node):
+    def initial_setup(self, id, location, emergency_type, node, rng):
         self.id = id
         self.location = location
         self.type = emergency_type
         self.node = node
 
         if self.type != None:
-            if self.type == 1:
-                self.count = np.random.random_integers(4,8)
-            elif self.type == 2:
-                self.count = np.random.random_integers(10,15)
-            elif self.type == 3:
-                self.count = np.random.random_integers(25,35)
-            elif self.type == 4:
-                self.count = np.random.random_integers(55,70)
-            else:
-                self.count = np.random.random_integers(100,150)
+            self.count = random_emergency_count(self.type, rng)
 
     def update_counter(self):
         if self.active:
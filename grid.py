@@ -0,0 +1,67 @@
+import numpy as np
+
+# Array-native width x height grid. Nodes are the (x, y) tuples of nx.grid_2d_graph,
+# numbered x*height + y, and nothing is allocated per node
+
+class GridNodes:
+
+    def __init__(self, width, height):
+
+        # Grid dimensions, node index i is the tuple divmod(i, height)
+        self.width = width
+        self.height = height
+
+    def __len__(self):
+        return self.width * self.height
+
+    def __getitem__(self, index):
+        index = int(index)
+        if index < 0 or index >= len(self):
+            raise IndexError("Grid node index out of range: " + str(index))
+        return divmod(index, self.height)
+
+    def __iter__(self):
+        for x in range(self.width):
+            for y in range(self.height):
+                yield (x, y)
+
+class GridIndex:
+
+    def __init__(self, width, height):
+
+        # Inverse of GridNodes, from (x, y) tuples to node indices
+        self.width = width
+        self.height = height
+
+    def __len__(self):
+        return self.width * self.height
+
+    def __contains__(self, node):
+        return isinstance(node, tuple) and len(node) == 2 and 0 <= node[0] < self.width and 0 <= node[1] < self.height
+
+    def __getitem__(self, node):
+        if node not in self:
+            raise KeyError(node)
+        return node[0] * self.height + node[1]
+
+    def __iter__(self):
+        return iter(GridNodes(self.width, self.height))
+
+    def get(self, node, default=None):
+        if node not in self:
+            return default
+        return node[0] * self.height + node[1]
+
+def edge_count(width, height):
+    return width*(height-1) + height*(width-1)
+
+def edge_indices(width, height):
+    # (E, 2) node index pairs, edges along the x axis first
+    indices = np.arange(width*height, dtype=np.int64).reshape(width, height)
+    x_edges = np.stack([indices[:-1].ravel(), indices[1:].ravel()], axis=1)
+    y_edges = np.stack([indices[:, :-1].ravel(), indices[:, 1:].ravel()], axis=1)
+    return np.concatenate([x_edges, y_edges])
+
+def drawing_positions(width, height, draw_width, draw_height):
+    x, y = np.divmod(np.arange(width*height, dtype=np.int64), height)
+    return np.stack([x * (draw_width / width), y * (draw_height / height)], axis=1)
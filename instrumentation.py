@@ -0,0 +1,139 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+# Routing calls counted as shortest-path queries
+ROUTING_QUERIES = ["distance", "next_hop", "distances", "distance_matrix", "distance_matrix_by_index", "distances_by_index", "next_hops_by_index", "path_by_index", "nearest_sources"]
+
+class Instrumentation:
+
+    enabled = True
+
+    def __init__(self):
+
+        # Nanoseconds spent per phase, one dictionary per cycle
+        self.cycle_timings = []
+        self.current = {}
+
+        # Calls per phase over the whole run
+        self.calls = {}
+
+        # Shortest-path queries issued to the routing layer
+        self.path_queries = 0
+        self.cycle_start_queries = 0
+
+    def begin_cycle(self):
+        self.current = {}
+        self.cycle_start_queries = self.path_queries
+
+    def end_cycle(self):
+        self.current["path_queries"] = self.path_queries - self.cycle_start_queries
+        self.cycle_timings.append(self.current)
+
+    def idle_cycles(self, count):
+        # Cycles that passed without running any phase
+        self.cycle_timings.extend({"path_queries": 0} for cycle in range(count))
+
+    def start(self):
+        return time.perf_counter_ns()
+
+    def stop(self, phase, start):
+        self.current[phase] = self.current.get(phase, 0) + time.perf_counter_ns() - start
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def wrap_routing(self, routing):
+        if routing == None or isinstance(routing, CountingRouting):
+            return routing
+        return CountingRouting(routing, self)
+
+    def summary(self):
+        summary = {}
+        for phase in self.calls:
+            timings = [cycle.get(phase, 0) for cycle in self.cycle_timings]
+            summary[phase] = {
+                "calls": self.calls[phase],
+                "total_ms": sum(timings) / 1e6,
+                "mean_ms": sum(timings) / max(len(timings), 1) / 1e6,
+                "max_ms": max(timings, default=0) / 1e6,
+            }
+        summary["path_queries"] = self.path_queries
+        summary["cycles"] = len(self.cycle_timings)
+        return summary
+
+    def dump(self, path):
+        with open(path, "w") as timings_file:
+            json.dump({"summary": self.summary(), "cycles": self.cycle_timings}, timings_file)
+
+class NullInstrumentation:
+
+    enabled = False
+
+    def begin_cycle(self):
+        pass
+
+    def end_cycle(self):
+        pass
+
+    def idle_cycles(self, count):
+        pass
+
+    def start(self):
+        return 0
+
+    def stop(self, phase, start):
+        pass
+
+    def wrap_routing(self, routing):
+        return routing
+
+# Shared instance used whenever instrumentation is off
+DISABLED = NullInstrumentation()
+
+class CountingRouting:
+
+    def __init__(self, routing, instrumentation):
+        self.routing = routing
+        self.instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        attribute = getattr(self.routing, name)
+        if name not in ROUTING_QUERIES:
+            return attribute
+
+        instrumentation = self.instrumentation
+
+        def counted(*args, **kwargs):
+            instrumentation.path_queries += 1
+            return attribute(*args, **kwargs)
+
+        return counted
+
+def profiled(function, prefix):
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+
+    profiler.enable()
+    try:
+        result = function()
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Binary cProfile stats, readable with pstats or snakeviz
+        profiler.dump_stats(prefix + ".prof")
+
+        with open(prefix + ".txt", "w") as report:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(30)
+            report.write(stream.getvalue())
+            report.write("\nTraced memory: current " + str(round(current / 2**20, 3)) + " MB, peak " + str(round(peak / 2**20, 3)) + " MB\n")
+            report.write("Top allocations by line:\n")
+            for statistic in snapshot.statistics("lineno")[:25]:
+                report.write(str(statistic) + "\n")
+
+    return result
@@ -0,0 +1,264 @@
+import math
+
+EMERGENCY_TYPES = [1, 2, 3, 4, 5]
+
+# A response succeeds when the first agent is on scene and the emergency is resolved within these cycles
+FIRST_RESPONSE_TARGETS = {1: 12, 2: 10, 3: 8, 4: 7, 5: 5}
+RESOLUTION_TARGETS = {1: 5, 2: 6, 3: 8, 4: 12, 5: 16}
+
+# Quantiles reported for response and resolution times
+QUANTILES = [0.5, 0.9, 0.99]
+
+class RunningStats:
+
+    def __init__(self):
+
+        # Count, sum with its Neumaier compensation and sum of squared deviations from the mean
+        self.count = 0
+        self.total = 0.0
+        self.compensation = 0.0
+        self.deviations = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value):
+        previous_mean = self.mean() if self.count > 0 else 0.0
+        self.add_to_total(value, 0.0)
+        self.count += 1
+        self.deviations += (value - previous_mean) * (value - self.mean())
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def add_repeated(self, value, count):
+        # count equal values, merged as one group without deviations of its own
+        if count <= 0:
+            return
+        group = RunningStats()
+        group.count = count
+        group.total = value * count
+        group.minimum = value
+        group.maximum = value
+        self.merge(group)
+
+    def add_to_total(self, value, compensation):
+        # The compensation carries the low order bits lost by the sum, so the mean stays
+        # as close to the exact one as a full sum over every value
+        total = self.total + value
+        if abs(self.total) >= abs(value):
+            self.compensation += (self.total - total) + value
+        else:
+            self.compensation += (value - total) + self.total
+        self.total = total
+        self.compensation += compensation
+
+    def mean(self):
+        if self.count == 0:
+            return math.nan
+        return (self.total + self.compensation) / self.count
+
+    def variance(self, ddof=0):
+        if self.count - ddof <= 0:
+            return math.nan
+        return self.deviations / (self.count - ddof)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count > 0:
+            # Parallel combination of the squared deviations (Chan et al.)
+            delta = other.mean() - self.mean()
+            self.deviations += other.deviations + delta * delta * self.count * other.count / (self.count + other.count)
+        else:
+            self.deviations = other.deviations
+        self.add_to_total(other.total, other.compensation)
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def state(self):
+        return {"count": self.count, "total": self.total, "compensation": self.compensation, "deviations": self.deviations, "minimum": self.minimum if self.count > 0 else None, "maximum": self.maximum if self.count > 0 else None}
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls()
+        stats.count = state["count"]
+        stats.total = state["total"]
+        stats.compensation = state["compensation"]
+        stats.deviations = state["deviations"]
+        if stats.count > 0:
+            stats.minimum = state["minimum"]
+            stats.maximum = state["maximum"]
+        return stats
+
+class ExponentialMean:
+
+    def __init__(self, decay):
+
+        # Weight of the newest value, older values fade by (1 - decay) per update
+        self.decay = decay
+        self.value = None
+
+    def add(self, value):
+        if self.value == None:
+            self.value = float(value)
+        else:
+            self.value += self.decay * (value - self.value)
+
+class QuantileSketch:
+
+    def __init__(self, relative_accuracy=0.01):
+
+        # Positive values fall in logarithmic buckets, so every quantile is within relative_accuracy
+        # of the exact one, memory grows with the log of the largest value and sketches merge by
+        # adding their buckets
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge quantile sketches of different accuracy")
+        for key in other.buckets:
+            self.buckets[key] = self.buckets.get(key, 0) + other.buckets[key]
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def state(self):
+        return {"relative_accuracy": self.relative_accuracy, "zero_count": self.zero_count, "buckets": {str(key): count for key, count in self.buckets.items()}}
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state["relative_accuracy"])
+        sketch.zero_count = state["zero_count"]
+        sketch.buckets = {int(key): count for key, count in state["buckets"].items()}
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
+
+class EmergencyStatistics:
+
+    def __init__(self, evaluation_decay=None, relative_accuracy=0.01):
+
+        # Severity of resolved emergencies, which sets how many agents the next one of the type gets,
+        # averaged over every resolution or exponentially weighted when a decay is given
+        self.evaluation_decay = evaluation_decay
+        self.severity = {i: RunningStats() for i in EMERGENCY_TYPES}
+        self.weighted_severity = {i: ExponentialMean(evaluation_decay) for i in EMERGENCY_TYPES} if evaluation_decay != None else None
+
+        # Resolved and successful emergencies
+        self.responses = {i: 0 for i in EMERGENCY_TYPES}
+        self.successes = {i: 0 for i in EMERGENCY_TYPES}
+
+        # First response and resolution times, in cycles
+        self.response_times = {i: RunningStats() for i in EMERGENCY_TYPES}
+        self.resolution_times = {i: RunningStats() for i in EMERGENCY_TYPES}
+        self.response_sketches = {i: QuantileSketch(relative_accuracy) for i in EMERGENCY_TYPES}
+        self.resolution_sketches = {i: QuantileSketch(relative_accuracy) for i in EMERGENCY_TYPES}
+
+    def record(self, emergency_type, severity, response_time, resolution_time):
+        self.severity[emergency_type].add(severity)
+        if self.weighted_severity != None:
+            self.weighted_severity[emergency_type].add(severity)
+
+        self.responses[emergency_type] += 1
+        if response_time <= FIRST_RESPONSE_TARGETS[emergency_type] and resolution_time <= RESOLUTION_TARGETS[emergency_type]:
+            self.successes[emergency_type] += 1
+
+        self.response_times[emergency_type].add(response_time)
+        self.resolution_times[emergency_type].add(resolution_time)
+        self.response_sketches[emergency_type].add(response_time)
+        self.resolution_sketches[emergency_type].add(resolution_time)
+
+    def evaluation(self, emergency_type):
+        if self.weighted_severity != None:
+            return int(self.weighted_severity[emergency_type].value)
+        return int(self.severity[emergency_type].mean())
+
+    def response_success(self):
+        # Percentage of successful responses per type with any, and over every type as 0
+        response_success = {}
+        for i in EMERGENCY_TYPES:
+            if self.responses[i] != 0:
+                response_success[i] = (self.successes[i] / self.responses[i]) * 100
+
+        total_responses = sum(self.responses.values())
+        if total_responses != 0:
+            response_success[0] = (sum(self.successes.values()) / total_responses) * 100
+        return response_success
+
+    def mean_times(self):
+        return {i: (self.response_times[i].mean(), self.resolution_times[i].mean()) for i in EMERGENCY_TYPES if self.responses[i] != 0}
+
+    def quantiles(self, quantiles=QUANTILES):
+        result = {}
+        for i in EMERGENCY_TYPES:
+            if self.responses[i] != 0:
+                result[i] = {
+                    "response": {"p" + str(round(q*100)): self.response_sketches[i].quantile(q) for q in quantiles},
+                    "resolution": {"p" + str(round(q*100)): self.resolution_sketches[i].quantile(q) for q in quantiles},
+                }
+        return result
+
+    def merge(self, other):
+        # Combines the statistics of another run, such as a parallel replica
+        for i in EMERGENCY_TYPES:
+            self.severity[i].merge(other.severity[i])
+            self.responses[i] += other.responses[i]
+            self.successes[i] += other.successes[i]
+            self.response_times[i].merge(other.response_times[i])
+            self.resolution_times[i].merge(other.resolution_times[i])
+            self.response_sketches[i].merge(other.response_sketches[i])
+            self.resolution_sketches[i].merge(other.resolution_sketches[i])
+
+    def state(self):
+        state = {str(i): {
+            "severity": self.severity[i].state(),
+            "weighted_severity": self.weighted_severity[i].value if self.weighted_severity != None else None,
+            "responses": self.responses[i],
+            "successes": self.successes[i],
+            "response_times": self.response_times[i].state(),
+            "resolution_times": self.resolution_times[i].state(),
+            "response_sketch": self.response_sketches[i].state(),
+            "resolution_sketch": self.resolution_sketches[i].state(),
+        } for i in EMERGENCY_TYPES}
+        state["evaluation_decay"] = self.evaluation_decay
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        statistics = cls(state.get("evaluation_decay"))
+        for i in EMERGENCY_TYPES:
+            entry = state[str(i)]
+            statistics.severity[i] = RunningStats.from_state(entry["severity"])
+            if statistics.weighted_severity != None:
+                statistics.weighted_severity[i].value = entry.get("weighted_severity")
+            statistics.responses[i] = entry["responses"]
+            statistics.successes[i] = entry["successes"]
+            statistics.response_times[i] = RunningStats.from_state(entry["response_times"])
+            statistics.resolution_times[i] = RunningStats.from_state(entry["resolution_times"])
+            statistics.response_sketches[i] = QuantileSketch.from_state(entry["response_sketch"])
+            statistics.resolution_sketches[i] = QuantileSketch.from_state(entry["resolution_sketch"])
+        return statistics
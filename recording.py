@@ -0,0 +1,166 @@
+import multiprocessing
+import os
+import queue as queues
+import shutil
+import subprocess
+import numpy as np
+import graphs as graphs
+import renderer as renderer
+
+# Emergency colors sent to the worker as small integer codes
+PALETTE = [renderer.EMPTY_COLOR] + graphs.GraphNode.color_scale
+
+VIDEO_FORMATS = [".mp4", ".mkv", ".avi", ".mov"]
+
+class FrameRecorder:
+
+    def __init__(self, graph, path, fps=10, chunk_size=50):
+
+        # Output video or PNG directory, decided once the worker knows whether ffmpeg exists
+        self.path = path
+        self.fps = fps
+        self.chunk_size = chunk_size
+        self.color_codes = {color: code for code, color in enumerate(PALETTE)}
+
+        # Frames buffered since the last chunk was sent, changes stored in CSR form
+        # with the changes of frame f in nodes[offsets[f]:offsets[f+1]]
+        self.reset_chunk()
+        self.frames = 0
+
+        titles = graph.frame_titles()
+        titles["frame_title"] = graph.frame_title("")
+        setup = {
+            "positions": graph.drawing_positions(),
+            "edges": graph.edge_indices(),
+            "titles": titles,
+        }
+
+        # Spawned rather than forked, so no pyplot state of a live window leaks into the worker
+        context = multiprocessing.get_context("spawn")
+        self.queue = context.Queue()
+        self.result = context.Queue()
+        self.worker = context.Process(target=render_frames, args=(self.queue, self.result, setup, path, fps), daemon=True)
+        self.worker.start()
+
+    def reset_chunk(self):
+        self.cycles = []
+        self.color_offsets = [0]
+        self.color_nodes = []
+        self.color_values = []
+        self.count_offsets = [0]
+        self.count_nodes = []
+        self.count_values = []
+
+    def record(self, cycle, color_changes, count_changes):
+        self.cycles.append(cycle)
+        for index in color_changes:
+            self.color_nodes.append(index)
+            self.color_values.append(self.color_codes[color_changes[index]])
+        self.color_offsets.append(len(self.color_nodes))
+        for index in count_changes:
+            self.count_nodes.append(index)
+            self.count_values.append(count_changes[index])
+        self.count_offsets.append(len(self.count_nodes))
+
+        self.frames += 1
+        if len(self.cycles) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.cycles) == 0:
+            return
+        # A worker that died already reported its error, queueing more frames would only grow memory
+        if not self.worker.is_alive():
+            self.reset_chunk()
+            return
+        self.queue.put({
+            "cycles": np.array(self.cycles, dtype=np.int64),
+            "color_offsets": np.array(self.color_offsets, dtype=np.int64),
+            "color_nodes": np.array(self.color_nodes, dtype=np.int32),
+            "color_codes": np.array(self.color_values, dtype=np.int8),
+            "count_offsets": np.array(self.count_offsets, dtype=np.int64),
+            "count_nodes": np.array(self.count_nodes, dtype=np.int32),
+            "counts": np.array(self.count_values, dtype=np.int32),
+        })
+        self.reset_chunk()
+
+    def close(self):
+        # Waits for the worker to render every frame still queued
+        self.flush()
+        if self.worker.is_alive():
+            self.queue.put(None)
+
+        # Polled, so a worker that died without a result cannot block the simulation forever
+        output = None
+        while output == None:
+            try:
+                output = self.result.get(timeout=0.5)
+            except queues.Empty:
+                if not self.worker.is_alive():
+                    try:
+                        output = self.result.get(timeout=0.5)
+                    except queues.Empty:
+                        output = {"error": "recording worker exited with code " + str(self.worker.exitcode)}
+
+        # Chunks the worker never read must not keep this process from exiting
+        if not self.worker.is_alive():
+            self.queue.cancel_join_thread()
+        self.worker.join()
+        return output
+
+def video_writer(path, fps, width, height):
+    return subprocess.Popen(["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba", "-s", str(width) + "x" + str(height),
+        "-r", str(fps), "-i", "-", "-pix_fmt", "yuv420p", path], stdin=subprocess.PIPE)
+
+def render_frames(queue, result, setup, path, fps):
+    # Any failure is sent back as an error, so close() reports it instead of waiting for frames
+    try:
+        result.put(draw_frames(queue, setup, path, fps))
+    except Exception as error:
+        result.put({"error": type(error).__name__ + ": " + str(error), "path": path})
+
+def draw_frames(queue, setup, path, fps):
+    import matplotlib
+    matplotlib.use("Agg")
+
+    titles = setup["titles"]
+    frame_renderer = renderer.GraphRenderer(setup["positions"], setup["edges"], titles, interactive=False)
+    canvas = frame_renderer.figure.canvas
+    palette = np.array(PALETTE, dtype=object)
+
+    # A video needs ffmpeg, otherwise every frame is written as a PNG into a directory
+    root, extension = os.path.splitext(path)
+    writer = None
+    if extension.lower() in VIDEO_FORMATS and shutil.which("ffmpeg") != None:
+        width, height = canvas.get_width_height()
+        writer = video_writer(path, fps, width, height)
+        output = path
+    else:
+        output = root if extension != "" else path
+        os.makedirs(output, exist_ok=True)
+
+    frame = 0
+    while True:
+        chunk = queue.get()
+        if chunk == None:
+            break
+
+        for i in range(len(chunk["cycles"])):
+            colors = slice(chunk["color_offsets"][i], chunk["color_offsets"][i + 1])
+            counts = slice(chunk["count_offsets"][i], chunk["count_offsets"][i + 1])
+            frame_renderer.update_indices(titles["frame_title"] + str(chunk["cycles"][i]),
+                chunk["color_nodes"][colors], list(palette[chunk["color_codes"][colors]]),
+                chunk["count_nodes"][counts], chunk["counts"][counts])
+
+            if writer != None:
+                canvas.draw()
+                writer.stdin.write(canvas.buffer_rgba())
+            else:
+                frame_renderer.save(os.path.join(output, "frame_" + str(frame).zfill(6) + ".png"))
+            frame += 1
+
+    if writer != None:
+        writer.stdin.close()
+        writer.wait()
+
+    return {"path": output, "frames": frame, "video": writer != None}
@@ -0,0 +1,113 @@
+import numpy as np
+
+# Colors of the resource distribution panel
+EMPTY_COLOR = "grey"
+RESOURCE_COLOR = "#89cff0"
+
+class GraphRenderer:
+
+    def __init__(self, positions, edges, titles, interactive=True):
+
+        # Interactive renderers blit onto a pyplot window, the others draw on an Agg canvas
+        self.interactive = interactive
+
+        # (N, 2) node coordinates and (E, 2) edges, both by node index
+        coordinates = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+
+        # Current state of every node, updated in place
+        self.colors = np.array([EMPTY_COLOR] * len(coordinates), dtype=object)
+        self.counts = np.zeros(len(coordinates), dtype=np.int64)
+
+        if interactive:
+            import matplotlib.pyplot as plt
+            plt.ion()
+            self.figure, self.axis = plt.subplots(1, 2, num=1, figsize=(2*titles["width"], titles["height"]))
+            plt.show()
+        else:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            self.figure = Figure(figsize=(2*titles["width"], titles["height"]))
+            FigureCanvasAgg(self.figure)
+            self.axis = self.figure.subplots(1, 2)
+
+        self.title = self.figure.suptitle(titles["title"], fontsize=25, animated=interactive)
+        self.figure.text(0.18, 0.10, "Emergency distribution: "+str(titles["distribution"]), fontsize=20)
+        self.figure.text(0.66, 0.10, "Agent behaviour: "+str(titles["behaviour"]), fontsize=20)
+        self.figure.text(0.24, 0.04, "Total Resources: "+str(titles["resources"])+",    Total Emergencies: "+str(titles["emergencies"])+",    Total Cycles: "+str(titles["cycles"]), fontsize=20)
+
+        self.axis[0].set_title("Active emergencies", fontsize=20)
+        self.axis[1].set_title("Resource distribution per location", fontsize=20)
+
+        # Edges never change, they stay in the blitted background
+        from matplotlib.collections import LineCollection
+        segments = coordinates[edges]
+        for axis in self.axis:
+            axis.add_collection(LineCollection(segments, colors="k", linewidths=1.0, zorder=1))
+            axis.set_axis_off()
+
+        # Node collections and resource labels are redrawn on every frame
+        self.emergency_nodes = self.axis[0].scatter(coordinates[:, 0], coordinates[:, 1], s=300, c=list(self.colors), marker="o", zorder=2, animated=interactive)
+        self.resource_nodes = self.axis[1].scatter(coordinates[:, 0], coordinates[:, 1], s=300, c=list(self.colors), marker="s", zorder=2, animated=interactive)
+        self.labels = [self.axis[1].text(x, y, "", ha="center", va="center", fontsize=20, fontweight="bold", zorder=3, animated=interactive) for x, y in coordinates]
+
+        self.emergency_colors = self.emergency_nodes.get_facecolors()
+        self.resource_colors = self.resource_nodes.get_facecolors()
+
+        self.background = None
+        if interactive:
+            self.figure.canvas.mpl_connect("draw_event", self.capture_background)
+            self.figure.canvas.draw()
+
+    def capture_background(self, event=None):
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_animated()
+
+    def update(self, title, color_changes, count_changes):
+        color_indices = np.fromiter(color_changes, dtype=np.int64, count=len(color_changes))
+        count_indices = np.fromiter(count_changes, dtype=np.int64, count=len(count_changes))
+        self.update_indices(title, color_indices, list(color_changes.values()), count_indices, list(count_changes.values()))
+
+    def update_indices(self, title, color_indices, colors, count_indices, counts):
+        from matplotlib.colors import to_rgba_array
+        self.title.set_text(title)
+
+        if len(color_indices) > 0:
+            self.colors[color_indices] = colors
+            self.emergency_colors[color_indices] = to_rgba_array(list(self.colors[color_indices]))
+            self.emergency_nodes.set_facecolor(self.emergency_colors)
+
+        if len(count_indices) > 0:
+            self.counts[count_indices] = counts
+            self.resource_colors[count_indices] = to_rgba_array([RESOURCE_COLOR if count > 0 else EMPTY_COLOR for count in self.counts[count_indices]])
+            self.resource_nodes.set_facecolor(self.resource_colors)
+            for i in count_indices:
+                self.labels[i].set_text(str(self.counts[i]) if self.counts[i] > 0 else "")
+
+    def draw_animated(self):
+        self.figure.draw_artist(self.title)
+        self.axis[0].draw_artist(self.emergency_nodes)
+        self.axis[1].draw_artist(self.resource_nodes)
+        for i in np.flatnonzero(self.counts):
+            self.axis[1].draw_artist(self.labels[i])
+
+    def present(self, interval):
+        canvas = self.figure.canvas
+        if self.background == None:
+            canvas.draw()
+        canvas.restore_region(self.background)
+        self.draw_animated()
+        canvas.blit(self.figure.bbox)
+        canvas.flush_events()
+
+        # A timeout of zero would run the event loop forever
+        if interval > 0:
+            canvas.start_event_loop(interval)
+
+    def save(self, path):
+        self.figure.savefig(path)
+
+    def close(self):
+        if self.interactive:
+            import matplotlib.pyplot as plt
+            plt.close(self.figure)
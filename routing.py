@@ -0,0 +1,360 @@
+import numpy as np
+import networkx as nx
+from collections import OrderedDict
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path, dijkstra
+
+# Path lengths are those of nx.shortest_path, but among several shortest paths the step taken
+# differs from it: RoutingTable steps to the first neighbour, in networkx order, that lies on a
+# shortest path, and GridRouting walks along the x axis first. nx.shortest_path searches from
+# both ends at once, so its step depends on source and destination together and no
+# per-destination table can repeat it. Agents therefore take different (equally short) routes
+# than before these tables, and fixed-seed statistics differ from runs made before them
+
+class RoutingTable:
+
+    def __init__(self, graph, max_table_nodes=2500, cache_size=256, weight="weight"):
+
+        # Node <-> integer index maps
+        self.nodes = list(graph.nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.node_count = len(self.nodes)
+
+        # Adjacency in CSR form, neighbours kept in networkx order. Both directions of every
+        # edge are stored, so csgraph runs directed and skips symmetrizing on every call
+        self.indptr, self.indices, self.weights = adjacency_arrays(graph, self.index, weight)
+        self.degrees = np.diff(self.indptr)
+        self.adjacency = csr_matrix((self.weights, self.indices, self.indptr), shape=(self.node_count, self.node_count))
+        self.weighted = bool(np.any(self.weights != 1))
+
+        # Smallest dtype able to hold a node index or a hop count
+        self.dtype = np.int16 if self.node_count < np.iinfo(np.int16).max else np.int32
+        self.distance_dtype = np.float64 if self.weighted else self.dtype
+
+        # Full tables, indexed [destination, source]
+        self.distance_table = None
+        self.next_hop_table = None
+
+        # Per destination rows for graphs too big for the full tables
+        self.cache_size = cache_size
+        self.cached_rows = OrderedDict()
+
+        if self.node_count <= max_table_nodes:
+            self.build_tables()
+
+    def build_tables(self):
+        distances = shortest_path(self.adjacency, directed=True, unweighted=not self.weighted)
+        self.distance_table = np.full((self.node_count, self.node_count), -1, dtype=self.distance_dtype)
+        self.next_hop_table = np.full((self.node_count, self.node_count), -1, dtype=self.dtype)
+
+        for destination in range(self.node_count):
+            self.distance_table[destination], self.next_hop_table[destination] = self.evaluate_row(destination, distances[destination])
+
+    def evaluate_row(self, destination, distances):
+        reachable = np.isfinite(distances)
+        distance_row = np.where(reachable, distances, -1).astype(self.distance_dtype)
+        next_hop_row = np.full(self.node_count, -1, dtype=self.dtype)
+
+        # Every node steps to its first neighbour on a shortest path
+        neighbour_distances = np.where(reachable[self.indices], distances[self.indices] + self.weights, np.inf)
+        has_neighbours = self.degrees > 0
+        starts = self.indptr[:-1][has_neighbours]
+        closest = np.minimum.reduceat(neighbour_distances, starts)
+
+        positions = np.arange(len(self.indices))
+        candidates = np.where(neighbour_distances == np.repeat(closest, self.degrees[has_neighbours]), positions, len(positions))
+        first = np.minimum.reduceat(candidates, starts)
+
+        next_hop_row[has_neighbours] = self.indices[first]
+        next_hop_row[~reachable] = -1
+        next_hop_row[destination] = destination
+        return distance_row, next_hop_row
+
+    def row(self, destination):
+        if self.distance_table is not None:
+            return self.distance_table[destination], self.next_hop_table[destination]
+
+        if destination in self.cached_rows:
+            self.cached_rows.move_to_end(destination)
+            return self.cached_rows[destination]
+
+        distances = shortest_path(self.adjacency, directed=True, unweighted=not self.weighted, indices=destination)
+        self.cached_rows[destination] = self.evaluate_row(destination, distances)
+        if len(self.cached_rows) > self.cache_size:
+            self.cached_rows.popitem(last=False)
+        return self.cached_rows[destination]
+
+    def distance(self, source, destiny):
+        distance_row = self.row(self.index[destiny])[0]
+        distance = distance_row[self.index[source]].item()
+        if distance < 0:
+            raise nx.NetworkXNoPath("No path between " + str(source) + " and " + str(destiny))
+        return distance
+
+    def distance_matrix(self, sources, destinies):
+        return self.distance_matrix_by_index([self.index[source] for source in sources], [self.index[destiny] for destiny in destinies])
+
+    def distance_matrix_by_index(self, source_indices, destiny_indices):
+        if self.distance_table is not None:
+            distances = self.distance_table[np.ix_(source_indices, destiny_indices)].astype(np.float64)
+        else:
+            # Every missing source row comes from a single multi-source csgraph call,
+            # the others are shared with every query on the same source
+            missing = list(dict.fromkeys(index for index in source_indices if index not in self.cached_rows))
+            missing_destinies = set(index for index in destiny_indices if index not in self.cached_rows)
+            if len(missing_destinies) < len(missing):
+                # Distances are symmetric, fewer trees are needed from the other side
+                return self.distance_matrix_by_index(destiny_indices, source_indices).T
+            if missing:
+                rows = shortest_path(self.adjacency, directed=True, unweighted=not self.weighted, indices=missing)
+                for index, row in zip(missing, rows.reshape(len(missing), -1)):
+                    self.cached_rows[index] = self.evaluate_row(index, row)
+            distances = np.array([self.row(index)[0][destiny_indices] for index in source_indices], dtype=np.float64).reshape(len(source_indices), len(destiny_indices))
+            while len(self.cached_rows) > self.cache_size:
+                self.cached_rows.popitem(last=False)
+
+        distances[distances < 0] = np.inf
+        return distances
+
+    def distances(self, source, destinies):
+        distance_row = self.row(self.index[source])[0]
+        distances = distance_row[[self.index[destiny] for destiny in destinies]].astype(np.float64)
+        distances[distances < 0] = np.inf
+        return distances
+
+    def distances_by_index(self, source, destinies):
+        distances = self.row(source)[0][destinies].astype(np.float64)
+        distances[distances < 0] = np.inf
+        return distances
+
+    def next_hops_by_index(self, sources, destinies):
+        if self.next_hop_table is not None:
+            return self.next_hop_table[destinies, sources].astype(np.int64)
+
+        # Agents already at their destination stay, without loading its row
+        next_hops = np.array(sources, dtype=np.int64)
+        moving = sources != destinies
+        for destiny in np.unique(destinies[moving]):
+            same_destiny = moving & (destinies == destiny)
+            next_hops[same_destiny] = self.row(destiny)[1][sources[same_destiny]]
+        return next_hops
+
+    def path_by_index(self, source, destiny):
+        next_hop_row = self.row(destiny)[1]
+        if next_hop_row[source] < 0:
+            raise nx.NetworkXNoPath("No path between " + str(self.nodes[source]) + " and " + str(self.nodes[destiny]))
+
+        # Follows the next hops once, the same steps next_hop would give one at a time
+        path = [source]
+        while path[-1] != destiny:
+            path.append(int(next_hop_row[path[-1]]))
+        return np.array(path, dtype=self.dtype)
+
+    def nearest_sources(self, source_indices):
+        # One multi-source search labels every node with its closest source, as a position
+        # in source_indices, and with its parent in that search as the step toward it
+        source_indices = np.asarray(source_indices, dtype=np.int64)
+        distances, predecessors, sources = dijkstra(self.adjacency, directed=True, unweighted=not self.weighted, indices=source_indices, return_predecessors=True, min_only=True)
+
+        positions = np.full(self.node_count, -1, dtype=np.int64)
+        positions[source_indices[::-1]] = np.arange(len(source_indices))[::-1]
+        nearest = np.where(sources >= 0, positions[np.maximum(sources, 0)], -1)
+
+        next_hops = np.where(predecessors >= 0, predecessors, -1).astype(np.int64)
+        next_hops[source_indices] = source_indices
+        return nearest, next_hops
+
+    def edge_weight_by_index(self, source, destiny):
+        # Travel time of the edge between two neighbouring nodes
+        if not self.weighted:
+            return 1.0
+        neighbours = slice(self.indptr[source], self.indptr[source + 1])
+        return float(self.weights[neighbours][self.indices[neighbours] == destiny][0])
+
+    def edge_weights_by_index(self, sources, destinies):
+        if not self.weighted or len(sources) == 0:
+            return np.ones(len(sources), dtype=np.float64)
+        return np.asarray(self.adjacency[sources, destinies], dtype=np.float64).ravel()
+
+    def next_hop(self, source, destiny):
+        if source == destiny:
+            return source
+        next_hop_row = self.row(self.index[destiny])[1]
+        hop = int(next_hop_row[self.index[source]])
+        if hop < 0:
+            raise nx.NetworkXNoPath("No path between " + str(source) + " and " + str(destiny))
+        return self.nodes[hop]
+
+class GridRouting:
+
+    def __init__(self, width, height):
+
+        # Dimensions of the grid_2d_graph, nodes are (x, y) tuples
+        self.width = width
+        self.height = height
+
+        # Every edge of an unmodified grid takes one cycle
+        self.weighted = False
+
+    def distance(self, source, destiny):
+        return abs(source[0] - destiny[0]) + abs(source[1] - destiny[1])
+
+    def distance_matrix(self, sources, destinies):
+        sources = np.array(sources, dtype=np.int64).reshape(-1, 1, 2)
+        destinies = np.array(destinies, dtype=np.int64).reshape(1, -1, 2)
+        return np.abs(destinies - sources).sum(axis=2).astype(np.float64)
+
+    def distances(self, source, destinies):
+        destinies = np.array(destinies, dtype=np.int64).reshape(-1, 2)
+        return (np.abs(destinies[:, 0] - source[0]) + np.abs(destinies[:, 1] - source[1])).astype(np.float64)
+
+    def coordinates(self, indices):
+        # Node indices follow the grid_2d_graph order, x major
+        return np.divmod(indices, self.height)
+
+    def distance_matrix_by_index(self, sources, destinies):
+        source_x, source_y = self.coordinates(np.asarray(sources, dtype=np.int64).reshape(-1, 1))
+        destiny_x, destiny_y = self.coordinates(np.asarray(destinies, dtype=np.int64).reshape(1, -1))
+        return (np.abs(destiny_x - source_x) + np.abs(destiny_y - source_y)).astype(np.float64)
+
+    def distances_by_index(self, source, destinies):
+        source_x, source_y = divmod(int(source), self.height)
+        destiny_x, destiny_y = self.coordinates(destinies)
+        return (np.abs(destiny_x - source_x) + np.abs(destiny_y - source_y)).astype(np.float64)
+
+    def next_hops_by_index(self, sources, destinies):
+        source_x, source_y = self.coordinates(sources)
+        destiny_x, destiny_y = self.coordinates(destinies)
+        step_x = np.sign(destiny_x - source_x)
+        step_y = np.where(step_x == 0, np.sign(destiny_y - source_y), 0)
+        return (source_x + step_x) * self.height + source_y + step_y
+
+    def path_by_index(self, source, destiny):
+        source_x, source_y = divmod(int(source), self.height)
+        destiny_x, destiny_y = divmod(int(destiny), self.height)
+
+        # Along the x axis first, then along the y axis, as next_hop walks
+        step_x = 1 if destiny_x >= source_x else -1
+        step_y = 1 if destiny_y >= source_y else -1
+        x_leg = np.arange(source_x, destiny_x, step_x) * self.height + source_y
+        y_leg = destiny_x * self.height + np.arange(source_y, destiny_y + step_y, step_y)
+        return np.concatenate([x_leg, y_leg])
+
+    def nearest_sources(self, source_indices):
+        source_indices = np.asarray(source_indices, dtype=np.int64)
+        neighbours = GridNeighbours(self.width, self.height)
+        nodes = np.arange(self.width * self.height)
+
+        nearest = np.full(len(nodes), len(source_indices), dtype=np.int64)
+        np.minimum.at(nearest, source_indices, np.arange(len(source_indices)))
+        reached = nearest < len(source_indices)
+        first_seen = np.zeros(len(nodes), dtype=np.int64)
+
+        # Breadth-first from every source at once, level by level. A node takes the lowest
+        # source position among its parents, so the first of the closest sources wins
+        frontier = np.unique(source_indices)
+        while len(frontier) > 0:
+            valid = neighbours.valid_steps(frontier)
+            parents = np.repeat(frontier, valid.sum(axis=1))
+            children = (frontier[:, None] + neighbours.steps)[valid]
+            unreached = ~reached[children]
+            parents = parents[unreached]
+            children = children[unreached]
+            np.minimum.at(nearest, children, nearest[parents])
+
+            # Children reached from several parents enter the next level once
+            order = np.arange(len(children))
+            first_seen[children] = order
+            frontier = children[first_seen[children] == order]
+            reached[frontier] = True
+
+        return nearest, self.next_hops_by_index(nodes, source_indices[nearest])
+
+    def edge_weight_by_index(self, source, destiny):
+        return 1.0
+
+    def edge_weights_by_index(self, sources, destinies):
+        return np.ones(len(sources), dtype=np.float64)
+
+    def next_hop(self, source, destiny):
+        # Walk along the x axis first, then along the y axis
+        if source[0] != destiny[0]:
+            return (source[0] + (1 if destiny[0] > source[0] else -1), source[1])
+        if source[1] != destiny[1]:
+            return (source[0], source[1] + (1 if destiny[1] > source[1] else -1))
+        return source
+
+class Neighbours:
+
+    def __init__(self, indptr, indices):
+
+        # Neighbours of every node in CSR form, in networkx order
+        self.indptr = indptr
+        self.indices = indices
+
+    def degrees(self, nodes):
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return self.indptr[nodes + 1] - self.indptr[nodes]
+
+    def neighbour(self, nodes, choices):
+        return self.indices[self.indptr[np.asarray(nodes, dtype=np.int64)] + choices]
+
+class GridNeighbours:
+
+    def __init__(self, width, height):
+
+        # Neighbours computed from the coordinates, in grid_2d_graph order: x-1, x+1, y-1, y+1
+        self.width = width
+        self.height = height
+        self.steps = np.array([-height, height, -1, 1], dtype=np.int64)
+
+    def valid_steps(self, nodes):
+        x, y = np.divmod(nodes, self.height)
+        return np.stack([x > 0, x < self.width - 1, y > 0, y < self.height - 1], axis=-1)
+
+    def degrees(self, nodes):
+        return self.valid_steps(np.asarray(nodes, dtype=np.int64)).sum(axis=-1)
+
+    def neighbour(self, nodes, choices):
+        # The choice-th existing step of every node
+        nodes = np.asarray(nodes, dtype=np.int64)
+        counts = np.cumsum(self.valid_steps(nodes), axis=-1)
+        return nodes + self.steps[np.argmax(counts > np.expand_dims(choices, -1), axis=-1)]
+
+def nearest(distances, count):
+    reachable = np.flatnonzero(np.isfinite(distances))
+    count = min(count, len(reachable))
+    if count == 0:
+        return reachable
+
+    # Partition to the count closest, then a stable sort so ties keep their order
+    threshold = np.partition(distances[reachable], count-1)[count-1]
+    candidates = reachable[distances[reachable] <= threshold]
+    return candidates[np.argsort(distances[candidates], kind="stable")][:count]
+
+def is_unmodified_grid(graph, width, height, weight="weight"):
+    if graph.number_of_nodes() != width*height:
+        return False
+    if graph.number_of_edges() != width*(height-1) + height*(width-1):
+        return False
+    for node in graph.nodes:
+        if not (isinstance(node, tuple) and len(node) == 2 and 0 <= node[0] < width and 0 <= node[1] < height):
+            return False
+    for u, v, data in graph.edges(data=True):
+        if abs(u[0] - v[0]) + abs(u[1] - v[1]) != 1 or data.get(weight, 1) != 1:
+            return False
+    return True
+
+def adjacency_arrays(graph, index, weight="weight"):
+    indptr = np.zeros(len(index) + 1, dtype=np.int64)
+    indices = []
+    weights = []
+
+    for node in graph.nodes:
+        neighbours = graph.adj[node]
+        indptr[index[node] + 1] = len(neighbours)
+        for neighbour in neighbours:
+            indices.append(index[neighbour])
+            weights.append(neighbours[neighbour].get(weight, 1))
+
+    return np.cumsum(indptr), np.array(indices, dtype=np.int64), np.array(weights, dtype=np.float64)
@@ -0,0 +1,372 @@
+import json
+import math
+import os
+import time
+import itertools
+import click as click
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.stats import t as student_t
+import agent_system as agent
+import graphs as graphs
+import aasma as aasma
+import vector_engine as vector_engine
+import event_engine as event_engine
+import instrumentation as instrumentation
+import events as events
+import metrics as metrics
+import snapshot as snapshot
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+DISTRIBUTIONS = ['Uniform', 'Normal', 'Linear', 'Exponential']
+BEHAVIOURS = ['Idle', 'Patrol', 'Station', 'Mix']
+DISPATCH_MODES = ['Greedy', 'Batch']
+ENGINES = ['Object', 'Vector', 'Event']
+
+# Keys a resumed scenario takes from its snapshot, since they shaped the state saved in it
+SNAPSHOT_KEYS = ["width", "height", "emergencies", "distribution", "network", "weight", "evaluation_decay"]
+
+def default_scenario():
+    graph = graphs.Graph('Off')
+    return {
+        "name": None,
+        "width": graph.simulation_width,
+        "height": graph.simulation_height,
+        "resources": graph.simulation_resources,
+        "emergencies": graph.simulation_emergencies,
+        "cycles": graph.simulation_cycles,
+        "distribution": "Uniform",
+        "behaviour": "Idle",
+        "dispatch_mode": "Greedy",
+        "engine": "Object",
+        "network": None,
+        "weight": "weight",
+        "evaluation_decay": None,
+        "seed": None,
+        "resume": None,
+        "checkpoint": None,
+        "checkpoint_at": None,
+    }
+
+def snapshot_scenario(path):
+    try:
+        header = snapshot.read_header(path)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+    scenario = default_scenario()
+    if header["graph"]["kind"] == "grid":
+        scenario["width"] = header["graph"]["width"]
+        scenario["height"] = header["graph"]["height"]
+    else:
+        scenario["weight"] = header["graph"]["weight"]
+        if header["graph"].get("grid_width") != None:
+            scenario["width"] = header["graph"]["grid_width"]
+            scenario["height"] = header["graph"]["grid_height"]
+    scenario.update({
+        "resources": header["resources"],
+        "emergencies": header["total_emergencies"],
+        "cycles": header["total_cycles"],
+        "distribution": header["distribution"],
+        "behaviour": header["behaviour"],
+        "dispatch_mode": header["dispatch_mode"],
+        "evaluation_decay": header["statistics"].get("evaluation_decay"),
+    })
+    return {key: scenario[key] for key in SNAPSHOT_KEYS + ["resources", "cycles", "behaviour", "dispatch_mode"]}
+
+def load_scenarios(path):
+    if path.endswith(".toml"):
+        if tomllib == None:
+            raise click.UsageError("Reading TOML scenarios requires Python 3.11 or newer: " + path)
+        with open(path, "rb") as scenario_file:
+            content = tomllib.load(scenario_file)
+    else:
+        with open(path) as scenario_file:
+            content = json.load(scenario_file)
+
+    # A file holds one scenario, a list of them or a "scenarios" table
+    if isinstance(content, dict) and "scenarios" in content:
+        content = content["scenarios"]
+    if isinstance(content, dict):
+        content = [content]
+
+    scenarios = []
+    for i, entry in enumerate(content):
+        scenario = validate_scenario(entry)
+        if scenario["name"] == None:
+            scenario["name"] = path + "#" + str(i)
+        scenarios.append(scenario)
+    return scenarios
+
+def validate_scenario(entry):
+    scenario = default_scenario()
+
+    unknown = set(entry) - set(scenario) - {"node_size"}
+    if unknown:
+        raise click.BadParameter("Unknown scenario keys: " + ", ".join(sorted(unknown)))
+
+    # A resumed run starts from the values of its snapshot, and may only change what a fork can
+    if entry.get("resume") != None:
+        resumed = snapshot_scenario(entry["resume"])
+        fixed = [key for key in SNAPSHOT_KEYS if key in entry and entry[key] != resumed[key]]
+        if "node_size" in entry:
+            fixed.append("node_size")
+        if fixed:
+            raise click.BadParameter("Fixed by the snapshot " + str(entry["resume"]) + ": " + ", ".join(fixed))
+        scenario.update(resumed)
+
+    if "node_size" in entry:
+        root = math.floor(math.sqrt(entry["node_size"]))
+        scenario["width"] = root
+        scenario["height"] = root
+    scenario.update({key: entry[key] for key in entry if key != "node_size"})
+
+    for key in ["width", "height", "resources", "emergencies", "cycles"]:
+        if not isinstance(scenario[key], int) or scenario[key] <= 0:
+            raise click.BadParameter("Not a positive Integer. " + key + ": " + str(scenario[key]))
+    if scenario["distribution"] not in DISTRIBUTIONS:
+        raise click.BadParameter("Invalid distribution: " + str(scenario["distribution"]))
+    if scenario["behaviour"] not in BEHAVIOURS:
+        raise click.BadParameter("Invalid behaviour: " + str(scenario["behaviour"]))
+    if scenario["dispatch_mode"] not in DISPATCH_MODES:
+        raise click.BadParameter("Invalid dispatch mode: " + str(scenario["dispatch_mode"]))
+    if scenario["engine"] not in ENGINES:
+        raise click.BadParameter("Invalid engine: " + str(scenario["engine"]))
+    if scenario["network"] != None and not os.path.isfile(str(scenario["network"])):
+        raise click.BadParameter("Road network file not found: " + str(scenario["network"]))
+    if scenario["evaluation_decay"] != None and not (isinstance(scenario["evaluation_decay"], (int, float)) and 0 < scenario["evaluation_decay"] <= 1):
+        raise click.BadParameter("Evaluation decay must be in (0, 1]: " + str(scenario["evaluation_decay"]))
+    if (scenario["checkpoint"] == None) != (scenario["checkpoint_at"] == None):
+        raise click.BadParameter("checkpoint and checkpoint_at must be given together")
+    if scenario["checkpoint_at"] != None and (not isinstance(scenario["checkpoint_at"], int) or scenario["checkpoint_at"] < 0):
+        raise click.BadParameter("Not a non-negative Integer. checkpoint_at: " + str(scenario["checkpoint_at"]))
+    return scenario
+
+def build_simulation(scenario):
+    if scenario["resume"] != None:
+        return resume_simulation(scenario)
+
+    graph_rng, agent_rng = graphs.simulation_generators(scenario["seed"])
+
+    graph = graphs.Graph('Off', graph_rng)
+    if scenario["network"] != None:
+        graph.load_road_network(scenario["network"], scenario["weight"])
+    else:
+        graph.generate_grid_graph(scenario["width"], scenario["height"])
+    graph.initial_setup(scenario["emergencies"], scenario["cycles"], scenario["distribution"])
+
+    city_agent = agent.City_Agent(agent_rng)
+    city_agent.evaluation_decay = scenario["evaluation_decay"]
+    city_agent.initial_setup(graph, scenario["resources"], scenario["behaviour"])
+    graph.city_agent = city_agent
+
+    graph.exec_type = "Execution"
+    graph.behaviour = scenario["behaviour"]
+    graph.dispatch_mode = scenario["dispatch_mode"]
+
+    return graph, city_agent
+
+def resume_simulation(scenario):
+    # A seed gives the fork new random streams, otherwise it continues the saved ones
+    try:
+        graph, city_agent = snapshot.load_snapshot(scenario["resume"])
+        snapshot.fork(graph, city_agent, scenario["seed"], scenario["behaviour"], scenario["resources"])
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+    graph.dispatch_mode = scenario["dispatch_mode"]
+
+    return graph, city_agent
+
+def run_scenario(scenario, timings=None, profile=None, event_log=None):
+    start = time.perf_counter()
+    graph, city_agent = build_simulation(scenario)
+    if timings != None:
+        graph.set_instrumentation(instrumentation.Instrumentation())
+    if event_log != None:
+        try:
+            graph.set_event_log(events.EventLog(event_log))
+        except ValueError as error:
+            raise click.BadParameter(str(error))
+    setup_time = time.perf_counter() - start
+
+    def simulation():
+        # Cycles up to the checkpoint run on the object engine, whose state is the one a snapshot holds
+        if scenario["checkpoint"] != None:
+            aasma.simulate(graph, city_agent, scenario["cycles"], scenario["checkpoint_at"])
+            snapshot.save_snapshot(graph, city_agent, scenario["checkpoint"])
+
+        if scenario["engine"] == "Vector":
+            return vector_engine.VectorEngine(graph, city_agent).run(scenario["cycles"])
+        elif scenario["engine"] == "Event":
+            return event_engine.EventEngine(graph, city_agent).run(scenario["cycles"])
+        return aasma.simulate(graph, city_agent, scenario["cycles"])
+
+    if profile != None:
+        cycle_count = instrumentation.profiled(simulation, profile)
+    else:
+        cycle_count = simulation()
+    elapsed = time.perf_counter() - start
+
+    if timings != None:
+        graph.instrumentation.dump(timings)
+    graph.events.close()
+
+    return {
+        "scenario": scenario,
+        "cycles": cycle_count,
+        "response_success": {str(i): value for i, value in city_agent.calculate_response_success().items()},
+        "response_times": {str(i): list(value) for i, value in city_agent.calculate_response_times().items()},
+        "time_quantiles": {str(i): value for i, value in city_agent.statistics.quantiles().items()},
+        "emergency_evaluation": {str(i): value for i, value in city_agent.emergency_evaluation.items()},
+        "statistics": city_agent.statistics.state(),
+        "dispatch_time": {"mean": graph.dispatch_times.mean(), "max": graph.dispatch_times.maximum},
+        "setup_time": setup_time,
+        "elapsed_time": elapsed,
+    }
+
+def sweep_scenarios(base, distributions, behaviours, fleet_sizes, replicas, seed):
+    configurations = list(itertools.product(distributions, behaviours, fleet_sizes))
+
+    # Every run gets its own stream spawned from one root seed, kept as a 128 bit integer
+    # so the replicas do not share the birthday collisions of 32 bit seeds
+    seeds = np.random.SeedSequence(seed).spawn(len(configurations) * replicas)
+
+    scenarios = []
+    for i, (distribution, behaviour, resources) in enumerate(configurations):
+        for replica in range(replicas):
+            scenario = dict(base)
+            scenario["distribution"] = distribution
+            scenario["behaviour"] = behaviour
+            scenario["resources"] = resources
+            scenario["seed"] = int.from_bytes(seeds[i*replicas + replica].generate_state(4).tobytes(), "little")
+            scenario["name"] = distribution + "/" + behaviour + "/" + str(resources) + "#" + str(replica)
+            scenarios.append(validate_scenario(scenario))
+    return scenarios
+
+def configuration_key(scenario):
+    return (scenario["distribution"], scenario["behaviour"], scenario["resources"])
+
+def confidence_interval(values, confidence=0.95):
+    values = np.asarray(values, dtype=np.float64)
+    mean = float(np.mean(values))
+    if len(values) < 2:
+        return mean, None
+    half_width = student_t.ppf((1 + confidence) / 2, len(values) - 1) * np.std(values, ddof=1) / math.sqrt(len(values))
+    return mean, float(half_width)
+
+def aggregate_results(results):
+    groups = {}
+    for result in results:
+        groups.setdefault(configuration_key(result["scenario"]), []).append(result)
+
+    summary = []
+    for key in groups:
+        values = {"cycles": [result["cycles"] for result in groups[key]]}
+        for result in groups[key]:
+            for i, value in result["response_success"].items():
+                values.setdefault("response_success_" + i, []).append(value)
+
+        statistics = {}
+        for metric in values:
+            mean, half_width = confidence_interval(values[metric])
+            statistics[metric] = {"mean": mean, "ci95": half_width, "runs": len(values[metric])}
+
+        # Every emergency of every replica pooled, from the mergeable per-run statistics
+        pooled = metrics.EmergencyStatistics()
+        for result in groups[key]:
+            pooled.merge(metrics.EmergencyStatistics.from_state(result["statistics"]))
+
+        summary.append({"distribution": key[0], "behaviour": key[1], "resources": key[2], "runs": len(groups[key]), "statistics": statistics,
+            "pooled": {"response_success": {str(i): value for i, value in pooled.response_success().items()}, "time_quantiles": {str(i): value for i, value in pooled.quantiles().items()}}})
+    return summary
+
+def json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Not JSON serializable: " + repr(value))
+
+def write_result(result, output, indent=None):
+    output.write(json.dumps(result, indent=indent, default=json_default) + "\n")
+    output.flush()
+
+@click.group()
+def runner():
+    """Headless execution of emergency scenarios, without prompts or visualization.\n
+    A scenario file is JSON or TOML holding one scenario, a list of them or a "scenarios" list. Keys are
+    width, height (or node_size), resources, emergencies, cycles, distribution, behaviour, dispatch_mode, engine
+    (Object, Vector or Event), network (a GraphML or edge list road network used instead of the grid) with its travel
+    time attribute weight, evaluation_decay (weight of the newest severity in an exponentially weighted evaluation,
+    a plain mean by default), seed and name;
+    missing keys take the fixed simulation values.\n
+    checkpoint with checkpoint_at saves the run into a snapshot file once it reaches that cycle. resume continues the
+    run of a snapshot, taking the missing keys from it; behaviour, resources, seed (new random streams), dispatch_mode,
+    engine and cycles fork it into a what-if variant, while the grid, network, emergencies, distribution and
+    evaluation_decay stay those of the snapshot."""
+
+@runner.command()
+@click.argument('scenario_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', type=click.File('w'), default='-', help='Result file, standard output by default')
+@click.option('--timings', type=click.Path(dir_okay=False, writable=True), default=None, help='Record the time of every phase of every cycle into this JSON file')
+@click.option('--profile', type=click.Path(dir_okay=False, writable=True), default=None, help='Run under cProfile and tracemalloc, dumping PROFILE.prof and PROFILE.txt')
+@click.option('--events', 'event_log', type=click.Path(dir_okay=False, writable=True), default=None, help='Stream emergency, dispatch, arrival and resolution events into a .jsonl, .npy or .parquet file')
+def run(scenario_file, output, timings, profile, event_log):
+    """Runs the first scenario of SCENARIO_FILE and writes its statistics as JSON."""
+    scenario = load_scenarios(scenario_file)[0]
+    write_result(run_scenario(scenario, timings, profile, event_log), output, indent=2)
+
+@runner.command()
+@click.argument('scenario_files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', type=click.File('w'), default='-', help='Result file, standard output by default')
+def batch(scenario_files, output):
+    """Runs every scenario of SCENARIO_FILES in order and writes one JSON line of statistics per scenario."""
+    scenarios = []
+    for scenario_file in scenario_files:
+        scenarios.extend(load_scenarios(scenario_file))
+
+    for scenario in scenarios:
+        write_result(run_scenario(scenario), output)
+        click.echo("Completed " + str(scenario["name"]), err=True)
+
+@runner.command()
+@click.option('--scenario-file', type=click.Path(exists=True, dir_okay=False), help='Scenario with the parameters shared by every run')
+@click.option('--distribution', 'distributions', multiple=True, type=click.Choice(DISTRIBUTIONS), help='Distributions to sweep, all by default')
+@click.option('--behaviour', 'behaviours', multiple=True, type=click.Choice(BEHAVIOURS), help='Behaviours to sweep, all by default')
+@click.option('--resources', 'fleet_sizes', multiple=True, type=click.IntRange(min=1), help='Fleet sizes to sweep, the scenario value by default')
+@click.option('--replicas', type=click.IntRange(min=1), default=10, help='Monte Carlo replicas per configuration')
+@click.option('--seed', type=int, default=0, help='Root seed from which every run seed is spawned')
+@click.option('--workers', type=click.IntRange(min=1), default=None, help='Worker processes, one per core by default')
+@click.option('--output', type=click.File('w'), default='-', help='Per-run result file, standard output by default')
+@click.option('--summary', type=click.File('w'), default=None, help='File for the per-configuration means and 95% confidence intervals')
+def sweep(scenario_file, distributions, behaviours, fleet_sizes, replicas, seed, workers, output, summary):
+    """Runs every combination of distribution, behaviour and fleet size with seeded replicas across a process pool.
+    Results are written as runs finish and aggregated per configuration at the end."""
+    base = load_scenarios(scenario_file)[0] if scenario_file != None else default_scenario()
+    if base["resume"] != None:
+        distributions = distributions or [base["distribution"]]
+    scenarios = sweep_scenarios(base, distributions or DISTRIBUTIONS, behaviours or BEHAVIOURS, fleet_sizes or [base["resources"]], replicas, seed)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(run_scenario, scenario) for scenario in scenarios]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            write_result(result, output)
+            click.echo("Completed " + result["scenario"]["name"] + " (" + str(len(results)) + "/" + str(len(scenarios)) + ")", err=True)
+
+    configurations = aggregate_results(results)
+    if summary != None:
+        write_result(configurations, summary, indent=2)
+    else:
+        for configuration in configurations:
+            if "response_success_0" not in configuration["statistics"]:
+                continue
+            success = configuration["statistics"]["response_success_0"]
+            click.echo(configuration["distribution"] + "/" + configuration["behaviour"] + "/" + str(configuration["resources"]) + ": " + str(round(success["mean"],3)) + " % +- " + str(round(success["ci95"] or 0,3)), err=True)
+
+if __name__ == "__main__":
+    runner()
@@ -0,0 +1,284 @@
+import json
+import zipfile
+import numpy as np
+import networkx as nx
+import agent_system as agent
+import graphs as graphs
+import metrics as metrics
+
+# A snapshot is a .npz archive of flat arrays plus a JSON header, read without pickle.
+# The version is bumped whenever a field changes meaning, snapshots of a newer version are refused
+SNAPSHOT_FORMAT = "aasma-snapshot"
+SNAPSHOT_VERSION = 2
+
+BEHAVIOURS = ["Idle", "Patrol", "Station"]
+
+def save_snapshot(graph, city_agent, path):
+    # State between two cycles, after the agents moved and before the next dispatch
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "rng": {"graph": graph.rng.bit_generator.state, "agents": city_agent.rng.bit_generator.state},
+        "current_cycle_count": graph.current_cycle_count,
+        "total_cycles": graph.total_cycles,
+        "total_emergencies": graph.total_emergencies,
+        "emergency_count": graph.emergency_count,
+        "arrival_count": graph.arrival_count,
+        "free_size": graph.free_nodes.size,
+        "resources": len(city_agent.resource_agents_list),
+        "exec_type": graph.exec_type,
+        "behaviour": graph.behaviour,
+        "distribution": graph.distribution,
+        "dispatch_mode": graph.dispatch_mode,
+        "emergency_evaluation": {str(i): value for i, value in city_agent.emergency_evaluation.items()},
+        "statistics": city_agent.statistics.state(),
+        "dispatch_times": graph.dispatch_times.state(),
+    }
+    arrays = {
+        "schedule_offsets": graph.emergency_schedule_offsets,
+        "schedule_types": graph.emergency_schedule_types,
+        "free_nodes": graph.free_nodes.nodes,
+    }
+
+    header["graph"] = network_state(graph, arrays)
+
+    # Emergencies in creation order, with -1 for a response time not reached yet
+    emergencies = [graph.active_emergencies_list[emergency_id] for emergency_id in graph.active_emergencies_list]
+    arrays["emergency_ids"] = np.array([emergency.id for emergency in emergencies], dtype=np.int64)
+    arrays["emergency_locations"] = np.array([emergency.node.index for emergency in emergencies], dtype=np.int64)
+    arrays["emergency_types"] = np.array([emergency.type for emergency in emergencies], dtype=np.int8)
+    arrays["emergency_counts"] = np.array([emergency.count for emergency in emergencies], dtype=np.int64)
+    arrays["emergency_longevities"] = np.array([emergency.longevity for emergency in emergencies], dtype=np.int64)
+    arrays["emergency_response_times"] = np.array([emergency.response_time if emergency.response_time != None else -1 for emergency in emergencies], dtype=np.int64)
+    arrays["emergency_active"] = np.array([emergency.active for emergency in emergencies], dtype=bool)
+
+    # Agents in registration order, with -1 for no station, emergency or time
+    agents = [city_agent.resource_agents_list[agent_id] for agent_id in city_agent.resource_agents_list]
+    arrays["agent_names"] = np.array([resource.name for resource in agents], dtype=np.int64)
+    arrays["agent_locations"] = np.array([resource.location_index for resource in agents], dtype=np.int64)
+    arrays["agent_behaviours"] = np.array([BEHAVIOURS.index(resource.behaviour) for resource in agents], dtype=np.int8)
+    arrays["agent_stations"] = np.array([resource.station_index if resource.station_index != None else -1 for resource in agents], dtype=np.int64)
+    arrays["agent_available"] = np.array([resource.available for resource in agents], dtype=bool)
+    arrays["agent_emergencies"] = np.array([resource.active_emergency.id if resource.active_emergency != None else -1 for resource in agents], dtype=np.int64)
+    arrays["agent_dispatch_times"] = np.array([resource.dispatch_time if resource.dispatch_time != None else -1 for resource in agents], dtype=np.int64)
+    arrays["agent_travel_times"] = np.array([resource.travel_time if resource.travel_time != None else -1 for resource in agents], dtype=np.int64)
+    arrays["agent_arrivals"] = np.array([resource.arrival for resource in agents], dtype=np.int64)
+    arrays["agent_travel_budgets"] = np.array([resource.travel_budget for resource in agents], dtype=np.float64)
+    arrays["agent_patrol_targets"] = np.array([resource.patrol_target for resource in agents], dtype=np.int64)
+
+    # City_Agent dictionaries, kept in their iteration order since dispatch follows it
+    arrays["available_agents"] = np.array(list(city_agent.available_agents), dtype=np.int64)
+    arrays["unavailable_agents"] = np.array(list(city_agent.unavailable_agents), dtype=np.int64)
+    arrays["active_emergencies"] = np.array(list(city_agent.active_emergencies), dtype=np.int64)
+    arrays["unsatisfied_emergencies"] = np.array(list(city_agent.unsatisfied_emergencies), dtype=np.int64)
+    arrays["unsatisfied_resources"] = np.array([city_agent.unsatisfied_emergencies[emergency_id][1] for emergency_id in city_agent.unsatisfied_emergencies], dtype=np.int64)
+    arrays["station_ids"] = np.array(list(city_agent.stations), dtype=np.int64)
+    arrays["station_nodes"] = np.array([graph.node_index[city_agent.stations[station_id]] for station_id in city_agent.stations], dtype=np.int64)
+
+    # Responders of the emergencies of responder_emergencies[e] in responder_agents[offsets[e]:offsets[e+1]]
+    arrays["responder_emergencies"] = np.array(list(city_agent.responders), dtype=np.int64)
+    arrays["responder_offsets"] = np.concatenate(([0], np.cumsum([len(city_agent.responders[emergency_id]) for emergency_id in city_agent.responders], dtype=np.int64)))
+    arrays["responder_agents"] = np.array([resource.name for emergency_id in city_agent.responders for resource in city_agent.responders[emergency_id]], dtype=np.int64)
+
+    arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+    with open(path, "wb") as snapshot_file:
+        np.savez_compressed(snapshot_file, **arrays)
+
+def network_state(graph, arrays):
+    # Unmodified grids are stored by their dimensions, any other graph edge by edge
+    if graph.is_unmodified_grid():
+        return {"kind": "grid", "width": graph.grid_width, "height": graph.grid_height}
+
+    if all(isinstance(node, str) for node in graph.node_list):
+        node_keys = "str"
+        arrays["nodes"] = np.array(graph.node_list, dtype=str)
+    elif all(isinstance(node, tuple) and len(node) == 2 for node in graph.node_list):
+        node_keys = "tuple"
+        arrays["nodes"] = np.array(graph.node_list, dtype=np.int64).reshape(-1, 2)
+    else:
+        raise ValueError("Snapshots need string or (x, y) node keys")
+
+    edges = edge_sequence(graph.graph, graph.node_list, graph.node_index)
+    arrays["edges"] = np.array(edges, dtype=np.int64).reshape(-1, 2)
+    arrays["edge_weights"] = np.array([graph.graph.edges[graph.node_list[u], graph.node_list[v]].get(graph.routing_weight, 1) for u, v in edges], dtype=np.float64)
+    if graph.node_positions is not None:
+        arrays["node_positions"] = graph.node_positions
+
+    # A modified grid keeps its dimensions, which place it on the drawing
+    return {"kind": "network", "node_keys": node_keys, "weight": graph.routing_weight, "cache_size": graph.routing_cache_size, "grid_width": graph.grid_width, "grid_height": graph.grid_height}
+
+def edge_sequence(network, node_list, node_index):
+    # Edges in an order whose insertion into an empty nx.Graph rebuilds every adjacency in its
+    # current order, which decides patrol moves and shortest-path ties. An edge is inserted once
+    # it is the next one of both its end nodes
+    adjacency = [[node_index[neighbour] for neighbour in network.adj[node]] for node in node_list]
+    heads = [0] * len(node_list)
+    sequence = []
+
+    pending = list(range(len(node_list)))
+    while len(pending) > 0:
+        u = pending.pop()
+        while heads[u] < len(adjacency[u]):
+            v = adjacency[u][heads[u]]
+            if adjacency[v][heads[v]] != u:
+                break
+            sequence.append((u, v))
+            heads[u] += 1
+            heads[v] += 1
+            pending.append(v)
+
+    if len(sequence) != network.number_of_edges():
+        raise ValueError("Adjacency order of the graph cannot be rebuilt by inserting edges")
+    return sequence
+
+def read_header(path):
+    try:
+        with np.load(path, allow_pickle=False) as archive:
+            header = json.loads(archive["header"].tobytes().decode("utf-8"))
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        raise ValueError("Not a simulation snapshot: " + str(path))
+
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError("Not a simulation snapshot: " + str(path))
+    if header["version"] > SNAPSHOT_VERSION:
+        raise ValueError("Snapshot version " + str(header["version"]) + " is newer than the supported version " + str(SNAPSHOT_VERSION) + ": " + str(path))
+    return header
+
+def generator(state):
+    rng = np.random.Generator(getattr(np.random, state["bit_generator"])())
+    rng.bit_generator.state = state
+    return rng
+
+def load_snapshot(path, visualization='Off'):
+    header = read_header(path)
+    with np.load(path, allow_pickle=False) as archive:
+        arrays = {key: archive[key] for key in archive.files}
+
+    graph = graphs.Graph(visualization, generator(header["rng"]["graph"]))
+    network = header["graph"]
+    if network["kind"] == "grid":
+        graph.generate_grid_graph(network["width"], network["height"])
+    else:
+        if network["node_keys"] == "str":
+            node_list = arrays["nodes"].tolist()
+        else:
+            node_list = [tuple(node) for node in arrays["nodes"].tolist()]
+        road_network = nx.Graph()
+        road_network.add_nodes_from(node_list)
+        road_network.add_edges_from((node_list[u], node_list[v], {network["weight"]: weight}) for (u, v), weight in zip(arrays["edges"].tolist(), arrays["edge_weights"].tolist()))
+        graph.set_road_network(road_network, network["weight"], network["cache_size"])
+        graph.grid_width = network.get("grid_width")
+        graph.grid_height = network.get("grid_height")
+        if "node_positions" in arrays:
+            graph.node_positions = arrays["node_positions"]
+
+    graph.total_cycles = header["total_cycles"]
+    graph.total_emergencies = header["total_emergencies"]
+    graph.draw_interval = 10/graph.total_cycles
+    graph.emergency_schedule_offsets = arrays["schedule_offsets"]
+    graph.emergency_schedule_types = arrays["schedule_types"]
+    graph.current_cycle_count = header["current_cycle_count"]
+    graph.emergency_count = header["emergency_count"]
+    if "dispatch_times" in header:
+        graph.dispatch_times = metrics.RunningStats.from_state(header["dispatch_times"])
+    graph.exec_type = header["exec_type"]
+    graph.behaviour = header["behaviour"]
+    graph.distribution = header["distribution"]
+    graph.dispatch_mode = header["dispatch_mode"]
+
+    city_agent = agent.City_Agent(generator(header["rng"]["agents"]))
+    city_agent.register_graph(graph)
+    graph.city_agent = city_agent
+    city_agent.emergency_evaluation = {int(i): value for i, value in header["emergency_evaluation"].items()}
+    city_agent.statistics = metrics.EmergencyStatistics.from_state(header["statistics"])
+    city_agent.evaluation_decay = city_agent.statistics.evaluation_decay
+    city_agent.stations = {station_id: graph.node_list[index] for station_id, index in zip(arrays["station_ids"].tolist(), arrays["station_nodes"].tolist())}
+
+    emergencies = {}
+    for i, emergency_id in enumerate(arrays["emergency_ids"].tolist()):
+        index = int(arrays["emergency_locations"][i])
+        emergency = graphs.Emergency()
+        emergency.id = emergency_id
+        emergency.location = graph.node_list[index]
+        emergency.node = graph.graph_nodes[index]
+        emergency.type = int(arrays["emergency_types"][i])
+        emergency.count = int(arrays["emergency_counts"][i])
+        emergency.longevity = int(arrays["emergency_longevities"][i])
+        emergency.response_time = int(arrays["emergency_response_times"][i]) if arrays["emergency_response_times"][i] >= 0 else None
+        emergency.active = bool(arrays["emergency_active"][i])
+        emergencies[emergency_id] = emergency
+
+        graph.active_emergencies_list[emergency_id] = emergency
+        emergency.node.activate_emergency(emergency)
+        graph.node_emergency_types[index] = emergency.type
+        graph.changed_nodes.add(index)
+
+    # Version 1 snapshots predate travel budgets, their agents had none left over
+    agent_count = len(arrays["agent_names"])
+    travel_budgets = arrays.get("agent_travel_budgets", np.zeros(agent_count, dtype=np.float64))
+    patrol_targets = arrays.get("agent_patrol_targets", np.full(agent_count, -1, dtype=np.int64))
+
+    resources = {}
+    for i, name in enumerate(arrays["agent_names"].tolist()):
+        resource = agent.Resource_Agent()
+        resource.name = name
+        resource.city_graph = graph
+        resource.city_agent = city_agent
+        resource.location_index = int(arrays["agent_locations"][i])
+        resource.current_location = graph.node_list[resource.location_index]
+        resource.behaviour = BEHAVIOURS[arrays["agent_behaviours"][i]]
+        if arrays["agent_stations"][i] >= 0:
+            resource.station_index = int(arrays["agent_stations"][i])
+            resource.station = graph.node_list[resource.station_index]
+        resource.available = bool(arrays["agent_available"][i])
+        if arrays["agent_emergencies"][i] >= 0:
+            resource.active_emergency = emergencies[int(arrays["agent_emergencies"][i])]
+            resource.emergency_location = resource.active_emergency.location
+            resource.emergency_index = resource.active_emergency.node.index
+        resource.dispatch_time = int(arrays["agent_dispatch_times"][i]) if arrays["agent_dispatch_times"][i] >= 0 else None
+        resource.travel_time = int(arrays["agent_travel_times"][i]) if arrays["agent_travel_times"][i] >= 0 else None
+        resource.travel_budget = float(travel_budgets[i])
+        resource.patrol_target = int(patrol_targets[i])
+        resources[name] = resource
+        city_agent.resource_agents_list[name] = resource
+
+    # Agents enter their nodes in their original order of arrival, those at their emergency are on scene
+    arrivals = dict(zip(arrays["agent_names"].tolist(), arrays["agent_arrivals"].tolist()))
+    for name in sorted(resources, key=lambda name: arrivals[name]):
+        resource = resources[name]
+        graph.add_resource_by_index(resource.location_index, name, resource)
+        resource.arrival = arrivals[name]
+        if resource.emergency_index == resource.location_index:
+            graph.add_on_scene(resource.location_index, resource)
+    graph.arrival_count = header["arrival_count"]
+
+    city_agent.available_agents = {name: resources[name] for name in arrays["available_agents"].tolist()}
+    city_agent.unavailable_agents = {name: resources[name] for name in arrays["unavailable_agents"].tolist()}
+    city_agent.active_emergencies = {emergency_id: emergencies[emergency_id] for emergency_id in arrays["active_emergencies"].tolist()}
+    city_agent.unsatisfied_emergencies = {emergency_id: (emergencies[emergency_id], left) for emergency_id, left in zip(arrays["unsatisfied_emergencies"].tolist(), arrays["unsatisfied_resources"].tolist())}
+    offsets = arrays["responder_offsets"].tolist()
+    agent_names = arrays["responder_agents"].tolist()
+    city_agent.responders = {emergency_id: [resources[name] for name in agent_names[offsets[i]:offsets[i + 1]]] for i, emergency_id in enumerate(arrays["responder_emergencies"].tolist())}
+
+    # Last, since activating the emergencies took their nodes out of the pool
+    graph.free_nodes.restore(arrays["free_nodes"], header["free_size"])
+
+    return graph, city_agent
+
+def fork(graph, city_agent, seed=None, behaviour=None, resources=None):
+    # What-if variant of a restored run: new random streams, behaviour or fleet size
+    if seed != None:
+        graph_rng, agent_rng = graphs.simulation_generators(seed)
+        graph.rng.bit_generator.state = graph_rng.bit_generator.state
+        city_agent.rng.bit_generator.state = agent_rng.bit_generator.state
+
+    if behaviour != None and behaviour != graph.behaviour:
+        city_agent.set_behaviour(behaviour)
+        graph.behaviour = behaviour
+
+    if resources != None:
+        fleet = len(city_agent.resource_agents_list)
+        if resources > fleet:
+            city_agent.add_agents(resources - fleet, graph.behaviour)
+        elif resources < fleet:
+            city_agent.remove_agents(fleet - resources)
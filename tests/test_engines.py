@@ -0,0 +1,176 @@
+import numpy as np
+import aasma as aasma
+import events as events
+import runner as runner
+import snapshot as snapshot
+import vector_engine as vector_engine
+import event_engine as event_engine
+import instrumentation as instrumentation
+
+def run_logged(snapshot_path, engine, log_path, cycles):
+    graph, city_agent = snapshot.load_snapshot(snapshot_path)
+    graph.set_event_log(events.EventLog(str(log_path)))
+    if engine == "Vector":
+        vector_engine.VectorEngine(graph, city_agent).run(cycles)
+    elif engine == "Event":
+        event_engine.EventEngine(graph, city_agent).run(cycles)
+    else:
+        aasma.simulate(graph, city_agent, cycles)
+    graph.events.close()
+    return np.array(events.load_events(str(log_path)))
+
+def forked_snapshot(tmp_path, behaviour="Patrol"):
+    # Warmed up run whose fleet loses agents, leaving non-contiguous agent names
+    scenario = runner.validate_scenario({"width": 10, "height": 10, "resources": 40, "emergencies": 150, "cycles": 150, "behaviour": behaviour, "seed": 11})
+    graph, city_agent = runner.build_simulation(scenario)
+    aasma.simulate(graph, city_agent, scenario["cycles"], 40)
+    city_agent.remove_agents(10)
+    assert sorted(city_agent.resource_agents_list) != list(range(len(city_agent.resource_agents_list)))
+    path = str(tmp_path / "fork.snap")
+    snapshot.save_snapshot(graph, city_agent, path)
+    return path
+
+def test_vector_events_name_agents_after_fork(tmp_path):
+    path = forked_snapshot(tmp_path)
+    object_log = run_logged(path, "Object", tmp_path / "object.npy", 150)
+    vector_log = run_logged(path, "Vector", tmp_path / "vector.npy", 150)
+
+    assert len(object_log) > 0
+    assert np.array_equal(np.sort(object_log), np.sort(vector_log))
+    assert set(object_log["agent"][object_log["event"] == events.DISPATCHED].tolist()) <= set(graph_names(path))
+
+def graph_names(path):
+    graph, city_agent = snapshot.load_snapshot(path)
+    return list(city_agent.resource_agents_list)
+
+def test_dispatch_events_keep_fractional_travel_times(tmp_path):
+    # Ring road where every hop takes 0.4
+    network = tmp_path / "ring.txt"
+    network.write_text("".join(str(i) + " " + str((i + 1) % 30) + " 0.4\n" for i in range(30)))
+    scenario = runner.validate_scenario({"network": str(network), "resources": 6, "emergencies": 40, "cycles": 60, "seed": 5})
+    graph, city_agent = runner.build_simulation(scenario)
+    graph.set_event_log(events.EventLog(str(tmp_path / "ring.jsonl")))
+    aasma.simulate(graph, city_agent, scenario["cycles"])
+    graph.events.close()
+
+    log = events.load_events(str(tmp_path / "ring.jsonl"))
+    distances = log["value"][(log["event"] == events.DISPATCHED) & (log["value"] > 0)]
+    assert len(distances) > 0
+    assert np.allclose(distances / 0.4, np.round(distances / 0.4))
+    assert np.any(distances != np.round(distances))
+
+def test_engines_write_identical_logs(tmp_path):
+    for behaviour in ["Idle", "Patrol", "Station", "Mix"]:
+        scenario = runner.validate_scenario({"width": 10, "height": 10, "resources": 30, "emergencies": 200, "cycles": 120, "behaviour": behaviour, "seed": 3})
+        graph, city_agent = runner.build_simulation(scenario)
+        path = str(tmp_path / (behaviour + ".snap"))
+        snapshot.save_snapshot(graph, city_agent, path)
+
+        logs = [run_logged(path, engine, tmp_path / (behaviour + engine + ".npy"), scenario["cycles"]) for engine in ["Object", "Vector", "Event"]]
+        assert len(logs[0]) > 0
+        assert np.array_equal(logs[0], logs[1])
+        assert np.array_equal(logs[0], logs[2])
+
+def test_engines_write_identical_logs_after_fork(tmp_path):
+    path = forked_snapshot(tmp_path)
+    logs = [run_logged(path, engine, tmp_path / (engine + ".npy"), 150) for engine in ["Object", "Vector", "Event"]]
+    assert np.array_equal(logs[0], logs[1])
+    assert np.array_equal(logs[0], logs[2])
+
+def test_agents_cross_edges_by_travel_time(tmp_path):
+    # Direct road 0-1-2 of 10 against a 7 edge detour of 0.7
+    network = tmp_path / "detour.txt"
+    detour = ["0", "a1", "a2", "a3", "a4", "a5", "a6", "2"]
+    network.write_text("0 1 5\n1 2 5\n" + "".join(u + " " + v + " 0.1\n" for u, v in zip(detour, detour[1:])))
+    scenario = runner.validate_scenario({"network": str(network), "resources": 1, "emergencies": 1, "cycles": 1, "seed": 1})
+    graph, city_agent = runner.build_simulation(scenario)
+    resource = city_agent.resource_agents_list[0]
+    resource.move_to(graph.node_index["0"])
+
+    resource.travel_towards(graph.node_index["2"])
+    assert resource.current_location == "2"
+
+    resource.move_to(graph.node_index["0"])
+    graph.remove_edge("a3", "a4")
+    for cycle in range(9):
+        resource.travel_towards(graph.node_index["2"])
+        assert resource.current_location != "2"
+    resource.travel_towards(graph.node_index["2"])
+    assert resource.current_location == "2"
+
+def test_engines_write_identical_logs_on_weighted_roads(tmp_path):
+    # Grid shaped road network with travel times below and above one cycle
+    rng = np.random.default_rng(7)
+    network = tmp_path / "roads.txt"
+    lines = []
+    for x in range(8):
+        for y in range(8):
+            if x < 7:
+                lines.append(str(x) + "_" + str(y) + " " + str(x + 1) + "_" + str(y) + " " + str(round(rng.uniform(0.2, 3), 2)) + "\n")
+            if y < 7:
+                lines.append(str(x) + "_" + str(y) + " " + str(x) + "_" + str(y + 1) + " " + str(round(rng.uniform(0.2, 3), 2)) + "\n")
+    network.write_text("".join(lines))
+
+    for behaviour in ["Patrol", "Station", "Mix"]:
+        scenario = runner.validate_scenario({"network": str(network), "resources": 20, "emergencies": 150, "cycles": 120, "behaviour": behaviour, "seed": 3})
+        graph, city_agent = runner.build_simulation(scenario)
+        path = str(tmp_path / (behaviour + ".snap"))
+        snapshot.save_snapshot(graph, city_agent, path)
+
+        logs = [run_logged(path, engine, tmp_path / (behaviour + engine + ".npy"), scenario["cycles"]) for engine in ["Object", "Vector", "Event"]]
+        assert len(logs[0]) > 0
+        assert np.array_equal(logs[0], logs[1])
+        assert np.array_equal(logs[0], logs[2])
+
+def test_greedy_dispatch_skips_unreachable_emergencies(tmp_path):
+    # Grid cut in two halves, agents cannot reach the emergencies on the other side
+    scenario = runner.validate_scenario({"width": 6, "height": 6, "resources": 6, "emergencies": 40, "cycles": 40, "behaviour": "Idle", "seed": 4})
+    graph, city_agent = runner.build_simulation(scenario)
+    for y in range(6):
+        graph.remove_edge((2, y), (3, y))
+    path = str(tmp_path / "cut.snap")
+    snapshot.save_snapshot(graph, city_agent, path)
+
+    graph, city_agent = snapshot.load_snapshot(path)
+    graph.set_event_log(events.EventLog(str(tmp_path / "object.npy")))
+    aasma.simulate(graph, city_agent, scenario["cycles"], 40)
+    graph.events.close()
+    # Emergencies across the cut wait for agents that can reach them
+    assert len(city_agent.unsatisfied_emergencies) > 0
+
+    graph, city_agent = snapshot.load_snapshot(path)
+    graph.set_event_log(events.EventLog(str(tmp_path / "vector.npy")))
+    engine = vector_engine.VectorEngine(graph, city_agent)
+    for cycle in range(40):
+        engine.step()
+    engine.finish()
+    graph.events.close()
+
+    object_log = np.array(events.load_events(str(tmp_path / "object.npy")))
+    vector_log = np.array(events.load_events(str(tmp_path / "vector.npy")))
+    dispatched = object_log[object_log["event"] == events.DISPATCHED]
+    assert len(dispatched) > 0
+    assert np.all(np.isfinite(dispatched["value"])) and np.all(dispatched["value"] >= 0)
+    assert np.array_equal(object_log, vector_log)
+
+def test_event_engine_counts_skipped_cycles(tmp_path):
+    scenario = runner.validate_scenario({"width": 10, "height": 10, "resources": 30, "emergencies": 40, "cycles": 200, "behaviour": "Idle", "seed": 3})
+    graph, city_agent = runner.build_simulation(scenario)
+    path = str(tmp_path / "idle.snap")
+    snapshot.save_snapshot(graph, city_agent, path)
+
+    graph, city_agent = snapshot.load_snapshot(path)
+    graph.set_instrumentation(instrumentation.Instrumentation())
+    cycles = aasma.simulate(graph, city_agent, scenario["cycles"])
+    object_graph = graph
+
+    graph, city_agent = snapshot.load_snapshot(path)
+    graph.set_instrumentation(instrumentation.Instrumentation())
+    engine = event_engine.EventEngine(graph, city_agent)
+    assert engine.run(scenario["cycles"]) == cycles
+    assert engine.skipped_cycles > 0
+
+    # Every cycle is a dispatch sample and a timed cycle, skipped or not
+    assert graph.dispatch_times.count == object_graph.dispatch_times.count == cycles
+    assert graph.instrumentation.summary()["cycles"] == object_graph.instrumentation.summary()["cycles"] == cycles
+    assert graph.dispatch_times.minimum == 0
@@ -0,0 +1,65 @@
+import json
+import numpy as np
+import metrics as metrics
+
+def test_merged_sketches_stay_within_relative_accuracy():
+    rng = np.random.default_rng(2)
+    parts = [rng.lognormal(2, 1, 3000), rng.exponential(5, 2000), np.zeros(100)]
+    sketch = metrics.QuantileSketch(0.01)
+    for part in parts:
+        other = metrics.QuantileSketch(0.01)
+        for value in part:
+            other.add(value)
+        sketch.merge(other)
+
+    # The sketch answers with the value of rank q * (count - 1), as method="lower" does
+    values = np.concatenate(parts)
+    assert sketch.count == len(values)
+    for q in [0.01, 0.25, 0.5, 0.9, 0.99, 1]:
+        exact = np.quantile(values, q, method="lower")
+        assert abs(sketch.quantile(q) - exact) <= sketch.relative_accuracy * exact
+
+def test_merged_running_stats_match_numpy():
+    rng = np.random.default_rng(3)
+    parts = [rng.normal(1e6, 3, 500), rng.normal(1e6 + 10, 1, 20), rng.normal(1e6 - 4, 7, 1000)]
+    stats = metrics.RunningStats()
+    for part in parts:
+        other = metrics.RunningStats()
+        for value in part:
+            other.add(value)
+        stats.merge(other)
+
+    values = np.concatenate(parts)
+    assert stats.count == len(values)
+    assert np.isclose(stats.mean(), np.mean(values), rtol=1e-15)
+    assert np.isclose(stats.variance(), np.var(values), rtol=1e-9)
+    assert np.isclose(stats.variance(1), np.var(values, ddof=1), rtol=1e-9)
+    assert stats.minimum == values.min() and stats.maximum == values.max()
+
+def test_evaluation_matches_mean_of_severity_history():
+    rng = np.random.default_rng(4)
+    statistics = metrics.EmergencyStatistics()
+    history = {i: [] for i in metrics.EMERGENCY_TYPES}
+    for i in range(2000):
+        emergency_type = int(rng.integers(1, 6))
+        severity = int(rng.integers(1, 40))
+        statistics.record(emergency_type, severity, int(rng.integers(0, 20)), int(rng.integers(1, 30)))
+        history[emergency_type].append(severity)
+
+        # Agents sent to the next emergency of the type, as the old list of severities gave it
+        assert statistics.evaluation(emergency_type) == int(np.mean(history[emergency_type]))
+
+def test_statistics_state_round_trip():
+    rng = np.random.default_rng(5)
+    for decay in [None, 0.1]:
+        # Type 5 never occurs, so empty statistics round trip as well
+        statistics = metrics.EmergencyStatistics(decay)
+        for i in range(500):
+            statistics.record(int(rng.integers(1, 5)), int(rng.integers(1, 40)), int(rng.integers(0, 20)), int(rng.integers(1, 30)))
+
+        restored = metrics.EmergencyStatistics.from_state(json.loads(json.dumps(statistics.state())))
+        assert restored.state() == statistics.state()
+        assert restored.response_success() == statistics.response_success()
+        assert restored.mean_times() == statistics.mean_times()
+        assert restored.quantiles() == statistics.quantiles()
+        assert [restored.evaluation(i) for i in range(1, 5)] == [statistics.evaluation(i) for i in range(1, 5)]
@@ -0,0 +1,84 @@
+import numpy as np
+import networkx as nx
+import pytest
+import routing as routing
+
+def weighted_graph():
+    # Connected random roads with a separate pair of nodes nothing else reaches
+    rng = np.random.default_rng(6)
+    graph = nx.connected_watts_strogatz_graph(30, 4, 0.3, seed=6)
+    for u, v in graph.edges:
+        graph.edges[u, v]["weight"] = float(rng.uniform(0.1, 5))
+    graph.add_edge("x", "y", weight=2.5)
+    return graph
+
+def test_fallback_rows_match_networkx():
+    graph = weighted_graph()
+    table = routing.RoutingTable(graph, max_table_nodes=10, cache_size=4)
+    assert table.distance_table is None
+    lengths = dict(nx.all_pairs_dijkstra_path_length(graph))
+    nodes = list(graph.nodes)
+
+    for source in nodes:
+        for destiny in nodes:
+            if destiny not in lengths[source]:
+                with pytest.raises(nx.NetworkXNoPath):
+                    table.distance(source, destiny)
+                continue
+            assert np.isclose(table.distance(source, destiny), lengths[source][destiny])
+
+            # The next hop and the whole path lie on a shortest path
+            hop = table.next_hop(source, destiny)
+            if source != destiny:
+                assert np.isclose(graph.edges[source, hop]["weight"] + lengths[hop][destiny], lengths[source][destiny])
+            path = [table.nodes[index] for index in table.path_by_index(table.index[source], table.index[destiny])]
+            assert path[0] == source and path[-1] == destiny
+            assert np.isclose(nx.path_weight(graph, path, "weight"), lengths[source][destiny])
+        assert len(table.cached_rows) <= 4
+
+def test_fallback_distance_matrix_matches_networkx():
+    graph = weighted_graph()
+    lengths = dict(nx.all_pairs_dijkstra_path_length(graph))
+    nodes = list(graph.nodes)
+
+    # Few sources and many destinies, and the other way round, which swaps to the cheaper side
+    for sources, destinies in [(nodes[:3], nodes), (nodes, nodes[:3]), (nodes[5:20], nodes[10:25])]:
+        table = routing.RoutingTable(graph, max_table_nodes=10, cache_size=4)
+        matrix = table.distance_matrix(sources, destinies)
+        expected = np.array([[lengths[source].get(destiny, np.inf) for destiny in destinies] for source in sources])
+        assert matrix.shape == (len(sources), len(destinies))
+        assert np.array_equal(np.isinf(matrix), np.isinf(expected))
+        assert np.allclose(matrix[np.isfinite(expected)], expected[np.isfinite(expected)])
+        assert len(table.cached_rows) <= 4
+
+def test_fallback_nearest_sources_match_networkx():
+    graph = weighted_graph()
+    table = routing.RoutingTable(graph, max_table_nodes=10, cache_size=4)
+    lengths = dict(nx.all_pairs_dijkstra_path_length(graph))
+    sources = [table.index[node] for node in [0, 7, 19]]
+
+    nearest, next_hops = table.nearest_sources(sources)
+    for node in graph.nodes:
+        index = table.index[node]
+        if node in ["x", "y"]:
+            assert nearest[index] == -1
+            continue
+        distances = [lengths[node][table.nodes[source]] for source in sources]
+        assert np.isclose(distances[nearest[index]], min(distances))
+
+        # One step toward the nearest source keeps the remaining distance shortest
+        source = table.nodes[sources[nearest[index]]]
+        hop = table.nodes[next_hops[index]]
+        if node != source:
+            assert np.isclose(graph.edges[node, hop]["weight"] + lengths[hop][source], lengths[node][source])
+
+def test_fallback_rows_match_full_tables():
+    graph = weighted_graph()
+    fallback = routing.RoutingTable(graph, max_table_nodes=10, cache_size=4)
+    full = routing.RoutingTable(graph)
+    assert full.distance_table is not None
+
+    indices = np.arange(full.node_count)
+    for destiny in range(full.node_count):
+        destinies = np.full(full.node_count, destiny)
+        assert np.array_equal(fallback.next_hops_by_index(indices, destinies), full.next_hops_by_index(indices, destinies))
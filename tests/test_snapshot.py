@@ -0,0 +1,42 @@
+import numpy as np
+import aasma as aasma
+import grid as grid
+import metrics as metrics
+import routing as routing
+import runner as runner
+import snapshot as snapshot
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    scenario = runner.validate_scenario({"width": 10, "height": 10, "resources": 25, "emergencies": 200, "cycles": 120, "behaviour": "Mix", "seed": 8})
+    graph, city_agent = runner.build_simulation(scenario)
+    full_cycles = aasma.simulate(graph, city_agent, scenario["cycles"])
+
+    paused, paused_agent = runner.build_simulation(scenario)
+    aasma.simulate(paused, paused_agent, scenario["cycles"], 50)
+    path = str(tmp_path / "run.snap")
+    snapshot.save_snapshot(paused, paused_agent, path)
+    resumed, resumed_agent = snapshot.load_snapshot(path)
+
+    assert isinstance(resumed.dispatch_times, metrics.RunningStats)
+    assert resumed.dispatch_times.count == 50
+    assert aasma.simulate(resumed, resumed_agent, scenario["cycles"]) == full_cycles
+    assert resumed_agent.statistics.state() == city_agent.statistics.state()
+    assert resumed.dispatch_times.count == graph.dispatch_times.count
+
+def test_modified_grid_keeps_grid_drawing(tmp_path):
+    scenario = runner.validate_scenario({"width": 8, "height": 6, "resources": 10, "emergencies": 60, "cycles": 60, "seed": 2})
+    graph, city_agent = runner.build_simulation(scenario)
+    graph.remove_edge((0, 0), (1, 0))
+    expected = grid.drawing_positions(8, 6, graph.draw_width, graph.draw_height)
+
+    assert not graph.is_unmodified_grid()
+    assert isinstance(graph.routing, routing.RoutingTable)
+    assert np.array_equal(graph.drawing_positions(), expected)
+
+    aasma.simulate(graph, city_agent, scenario["cycles"], 20)
+    path = str(tmp_path / "modified.snap")
+    snapshot.save_snapshot(graph, city_agent, path)
+    resumed, resumed_agent = snapshot.load_snapshot(path)
+    assert isinstance(resumed.routing, routing.RoutingTable)
+    assert np.array_equal(resumed.drawing_positions(), expected)
+    assert runner.snapshot_scenario(path)["width"] == 8
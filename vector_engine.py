@@ -0,0 +1,364 @@
+import time
+import numpy as np
+import routing as routing
+import graphs as graphs
+import agent_system as agent
+import events as events
+
+# Behaviour codes of the agent arrays
+IDLE = 0
+PATROL = 1
+STATION = 2
+BEHAVIOUR_CODES = {"Idle": IDLE, "Patrol": PATROL, "Station": STATION}
+
+class VectorEngine:
+
+    def __init__(self, graph, city_agent):
+
+        # Scenario built by the object engine, statistics are recorded on the City_Agent
+        self.graph = graph
+        self.city_agent = city_agent
+        self.routing = graph.routing
+
+        # Graph nodes and neighbours, in networkx order
+        self.node_list = graph.node_list
+        self.node_index = graph.node_index
+        self.neighbours = graph.neighbours
+
+        # Agent arrays, one row per Resource_Agent in registration order, with the name logged for each row
+        agents = [city_agent.resource_agents_list[agent_id] for agent_id in city_agent.resource_agents_list]
+        self.agent_rows = {resource.name: row for row, resource in enumerate(agents)}
+        self.names = np.array([resource.name for resource in agents], dtype=np.int64)
+        self.positions = np.array([resource.location_index for resource in agents], dtype=np.int64)
+        self.behaviours = np.array([BEHAVIOUR_CODES[resource.behaviour] for resource in agents], dtype=np.int8)
+        self.stations = np.array([resource.station_index if resource.station_index != None else -1 for resource in agents], dtype=np.int64)
+        self.available = np.array([resource.available for resource in agents], dtype=bool)
+        self.emergencies = np.array([resource.active_emergency.id if resource.active_emergency != None else -1 for resource in agents], dtype=np.int64)
+        self.dispatch_times = np.array([resource.dispatch_time or 0 for resource in agents], dtype=np.int64)
+        self.travel_times = np.array([resource.travel_time or 0 for resource in agents], dtype=np.int64)
+        self.travel_budgets = np.array([resource.travel_budget for resource in agents], dtype=np.float64)
+        self.patrol_targets = np.array([resource.patrol_target for resource in agents], dtype=np.int64)
+
+        # Order of arrival of each agent at its current node
+        self.arrivals = np.zeros(len(agents), dtype=np.int64)
+        self.arrival_count = 0
+        for graph_node in graph.graph_nodes:
+            for resource_id in graph_node.current_resources:
+                self.arrivals[self.agent_rows[resource_id]] = self.arrival_count
+                self.arrival_count += 1
+
+        # Available agents and responders of each emergency, in dispatch order
+        self.available_order = {self.agent_rows[agent_id]: None for agent_id in city_agent.available_agents}
+        self.responders = {}
+        for agent_id in city_agent.unavailable_agents:
+            row = self.agent_rows[agent_id]
+            self.responders.setdefault(int(self.emergencies[row]), []).append(row)
+
+        # Emergency arrays, indexed by emergency id
+        capacity = graph.emergency_count + len(graph.emergency_schedule_types)
+        self.emergency_locations = np.zeros(capacity, dtype=np.int64)
+        self.emergency_types = np.zeros(capacity, dtype=np.int8)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.longevities = np.zeros(capacity, dtype=np.int64)
+        self.response_times = np.full(capacity, -1, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.emergency_count = graph.emergency_count
+        self.active_count = 0
+
+        for emergency_id in graph.active_emergencies_list:
+            emergency = graph.active_emergencies_list[emergency_id]
+            self.emergency_locations[emergency_id] = self.node_index[emergency.location]
+            self.emergency_types[emergency_id] = emergency.type
+            self.counts[emergency_id] = emergency.count
+            self.longevities[emergency_id] = emergency.longevity
+            self.response_times[emergency_id] = emergency.response_time if emergency.response_time != None else -1
+            self.active[emergency_id] = True
+            self.active_count += 1
+
+        self.unsatisfied = {emergency_id: city_agent.unsatisfied_emergencies[emergency_id][1] for emergency_id in city_agent.unsatisfied_emergencies}
+
+        # Free node pool over node indices, in the same order as the graph's
+        self.free_nodes = graphs.NodePool(graph.free_nodes.nodes, graph.rng)
+        self.free_nodes.size = graph.free_nodes.size
+
+        self.current_cycle_count = graph.current_cycle_count
+
+    def run(self, cycles):
+        cycle_count = self.current_cycle_count
+
+        while cycle_count <= cycles or self.active_count > 0:
+            self.step()
+            cycle_count += 1
+
+        self.finish()
+        return cycle_count
+
+    def step(self):
+        instrumentation = self.graph.instrumentation
+
+        instrumentation.begin_cycle()
+        self.cycle_passed()
+
+        phase_start = instrumentation.start()
+        self.move_agents()
+        instrumentation.stop("movement", phase_start)
+        instrumentation.end_cycle()
+
+    def finish(self):
+        self.graph.current_cycle_count = self.current_cycle_count
+        self.graph.emergency_count = self.emergency_count
+
+    def cycle_passed(self):
+        instrumentation = self.graph.instrumentation
+
+        dispatch_start = time.perf_counter()
+        phase_start = instrumentation.start()
+
+        if self.graph.dispatch_mode == "Batch":
+            self.dispatch_batch()
+        else:
+            self.dispatch_closest_emergencies()
+
+        self.graph.dispatch_times.add(time.perf_counter() - dispatch_start)
+        instrumentation.stop("dispatch", phase_start)
+
+        phase_start = instrumentation.start()
+        self.update_counters()
+        instrumentation.stop("emergency_updates", phase_start)
+
+        phase_start = instrumentation.start()
+        self.generate_emergencies()
+        instrumentation.stop("emergency_generation", phase_start)
+        self.current_cycle_count += 1
+
+    def assign(self, row, emergency_id, distance):
+        self.graph.events.record(self.current_cycle_count, events.DISPATCHED, emergency_id, int(self.names[row]), int(self.positions[row]), events.as_value(distance))
+        self.available[row] = False
+        self.emergencies[row] = emergency_id
+        self.dispatch_times[row] = 0
+        self.travel_times[row] = 0
+        self.travel_budgets[row] = 0
+        self.patrol_targets[row] = -1
+        del self.available_order[row]
+        self.responders.setdefault(emergency_id, []).append(row)
+
+    def release(self, row):
+        self.available[row] = True
+        self.emergencies[row] = -1
+        self.dispatch_times[row] = 0
+        self.travel_times[row] = 0
+        self.travel_budgets[row] = 0
+        self.patrol_targets[row] = -1
+        self.available_order[row] = None
+
+    def dispatch_closest_emergencies(self):
+        for row in list(self.available_order):
+            if len(self.unsatisfied) == 0:
+                return
+            emergency_ids = list(self.unsatisfied)
+            distances = self.routing.distance_matrix_by_index(self.emergency_locations[emergency_ids], [self.positions[row]])[:, 0]
+            closest = int(np.argmin(distances))
+            # Agents cut off from every unsatisfied emergency stay available
+            if not np.isfinite(distances[closest]):
+                continue
+            emergency_id = emergency_ids[closest]
+
+            resources_left = self.unsatisfied[emergency_id]
+            if resources_left <= 0:
+                del self.unsatisfied[emergency_id]
+            else:
+                self.unsatisfied[emergency_id] = resources_left - 1
+            self.assign(row, emergency_id, distances[closest])
+
+    def dispatch_batch(self):
+        if len(self.unsatisfied) == 0 or len(self.available_order) == 0:
+            return
+        rows = np.fromiter(self.available_order, dtype=np.int64, count=len(self.available_order))
+        agent_locations = [self.node_list[position] for position in self.positions[rows]]
+
+        emergency_ids = list(self.unsatisfied)
+        locations = [self.node_list[location] for location in self.emergency_locations[emergency_ids]]
+        distances = self.routing.distance_matrix(locations, agent_locations)
+        resources_left = [self.unsatisfied[emergency_id] for emergency_id in emergency_ids]
+        emergency_types = self.emergency_types[emergency_ids].tolist()
+
+        for agent_row, emergency_row in agent.batch_assignment(resources_left, emergency_types, distances, self.city_agent.dispatch_weights):
+            emergency_id = emergency_ids[emergency_row]
+            resources_left = self.unsatisfied[emergency_id] - 1
+            if resources_left <= 0:
+                del self.unsatisfied[emergency_id]
+            else:
+                self.unsatisfied[emergency_id] = resources_left
+            self.assign(int(rows[agent_row]), emergency_id, distances[emergency_row, agent_row])
+
+    def dispatch_resources(self, emergency_id, resources_needed):
+        rows = np.fromiter(self.available_order, dtype=np.int64, count=len(self.available_order))
+        path_lengths = self.routing.distances_by_index(self.emergency_locations[emergency_id], self.positions[rows])
+        closest_agents = routing.nearest(path_lengths, resources_needed)
+
+        for i in range(resources_needed):
+            if i >= len(closest_agents):
+                self.unsatisfied[emergency_id] = resources_needed - i
+                return
+            self.assign(int(rows[closest_agents[i]]), emergency_id, path_lengths[closest_agents[i]])
+
+    def update_counters(self):
+        active = np.flatnonzero(self.active)
+        if len(active) == 0:
+            return
+        self.longevities[active] += 1
+
+        # First response is recorded as soon as any agent stands on the node
+        occupancy = np.bincount(self.positions, minlength=len(self.node_list))
+        occupied = active[occupancy[self.emergency_locations[active]] > 0]
+        first_response = occupied[self.response_times[occupied] < 0]
+        self.response_times[first_response] = self.longevities[first_response]
+
+        # Agents on scene work in order of arrival until the counter runs out
+        assisting = np.flatnonzero(self.emergencies >= 0)
+        assisting = assisting[self.positions[assisting] == self.emergency_locations[self.emergencies[assisting]]]
+        if len(assisting) > 0:
+            order = np.lexsort((self.arrivals[assisting], self.emergencies[assisting]))
+            assisting = assisting[order]
+            assisting_emergencies = self.emergencies[assisting]
+            group_start = np.flatnonzero(np.r_[True, assisting_emergencies[1:] != assisting_emergencies[:-1]])
+            group_sizes = np.diff(np.r_[group_start, len(assisting)])
+            ranks = np.arange(len(assisting)) - np.repeat(group_start, group_sizes)
+
+            working = assisting[ranks < self.counts[assisting_emergencies]]
+            self.dispatch_times[working] += 1
+            self.counts -= np.bincount(self.emergencies[working], minlength=len(self.counts))
+
+        # Emergencies in id order, each logging its first arrival before its resolution as the object engine does
+        arrived = set(first_response.tolist()) if self.graph.events.enabled else set()
+        for emergency_id in sorted(arrived.union(active[self.counts[active] <= 0].tolist())):
+            if emergency_id in arrived:
+                self.graph.events.record(self.current_cycle_count, events.FIRST_ARRIVAL, emergency_id, -1, int(self.emergency_locations[emergency_id]), int(self.response_times[emergency_id]))
+            if self.counts[emergency_id] <= 0:
+                self.delete_emergency(emergency_id)
+
+    def delete_emergency(self, emergency_id):
+        rows = self.responders.pop(emergency_id)
+        self.graph.events.record(self.current_cycle_count, events.RESOLVED, emergency_id, -1, int(self.emergency_locations[emergency_id]), int(self.longevities[emergency_id]))
+
+        # Severity is evaluated from the last agent dispatched
+        last = rows[-1]
+        if self.dispatch_times[last] > 0:
+            total_severity = self.dispatch_times[last] + self.travel_times[last]
+        else:
+            total_severity = -1
+
+        for row in rows:
+            self.graph.events.record(self.current_cycle_count, events.RELEASED, emergency_id, int(self.names[row]), int(self.positions[row]), int(self.dispatch_times[row]))
+            self.release(row)
+
+        self.city_agent.record_resolution(int(self.emergency_types[emergency_id]), int(total_severity) / len(rows), int(self.response_times[emergency_id]), int(self.longevities[emergency_id]))
+
+        if emergency_id in self.unsatisfied:
+            del self.unsatisfied[emergency_id]
+        self.active[emergency_id] = False
+        self.active_count -= 1
+        self.free_nodes.add(int(self.emergency_locations[emergency_id]))
+
+    def generate_emergencies(self):
+        cycle = self.current_cycle_count
+        offsets = self.graph.emergency_schedule_offsets
+        if cycle >= len(offsets) - 1:
+            return
+
+        for emergency_type in self.graph.emergency_schedule_types[offsets[cycle]:offsets[cycle + 1]].tolist():
+            location = self.free_nodes.sample()
+            if location == None:
+                continue
+
+            emergency_id = self.emergency_count
+            self.emergency_count += 1
+            self.emergency_locations[emergency_id] = location
+            self.emergency_types[emergency_id] = emergency_type
+            self.counts[emergency_id] = graphs.random_emergency_count(emergency_type, self.graph.rng)
+            self.active[emergency_id] = True
+            self.active_count += 1
+            self.free_nodes.remove(location)
+            self.graph.events.record(cycle, events.EMERGENCY_CREATED, emergency_id, -1, location, emergency_type)
+
+            resources_needed = self.city_agent.emergency_evaluation[emergency_type]
+            if resources_needed <= 0:
+                resources_needed = 1
+            self.dispatch_resources(emergency_id, resources_needed)
+
+    def move_agents(self):
+        assigned = self.emergencies >= 0
+        targets = np.where(assigned, self.emergency_locations[np.maximum(self.emergencies, 0)], -1)
+        heading = assigned & (self.positions != targets)
+        patrol = ~assigned & (self.behaviours == PATROL)
+        station = ~assigned & (self.behaviours == STATION)
+        self.travel_times[heading] += 1
+
+        # Edges crossed by every agent this cycle, each one a new arrival
+        hops = np.zeros(len(self.positions), dtype=np.int64)
+
+        # Agents resting at their station step onto it again, as the object engine does
+        resting = station & (self.positions == self.stations)
+        hops[resting] = 1
+
+        travelling = station & ~resting
+        destinations = np.where(heading, targets, self.stations)
+        self.travel_along_routes(np.flatnonzero(heading | travelling), destinations, hops)
+        self.patrol(np.flatnonzero(patrol), hops)
+
+        movers = np.flatnonzero(hops)
+        self.arrivals[movers] = self.arrival_count + np.cumsum(hops[movers]) - 1
+        self.arrival_count += int(hops.sum())
+
+    def travel_along_routes(self, rows, destinations, hops):
+        # Each cycle adds one unit of travel time, edges are crossed while it covers their weight,
+        # all agents one edge per round, and what is left waits for the next cycle
+        self.travel_budgets[rows] += 1
+        while len(rows) > 0:
+            next_positions = self.routing.next_hops_by_index(self.positions[rows], destinations[rows])
+            weights = self.routing.edge_weights_by_index(self.positions[rows], next_positions)
+            crossing = weights <= self.travel_budgets[rows]
+            rows = rows[crossing]
+            self.travel_budgets[rows] -= weights[crossing]
+            self.positions[rows] = next_positions[crossing]
+            hops[rows] += 1
+
+            arrived = self.positions[rows] == destinations[rows]
+            self.travel_budgets[rows[arrived]] = 0
+            rows = rows[~arrived]
+
+    def patrol(self, rows, hops):
+        if len(rows) == 0:
+            return
+
+        # One random neighbour per patrolling agent, drawn in agent order. Every edge of an
+        # unweighted graph takes exactly the cycle's travel time, so there is nothing to carry over
+        if not self.routing.weighted:
+            positions = self.positions[rows]
+            choices = self.city_agent.rng.integers(0, self.neighbours.degrees(positions))
+            self.positions[rows] = self.neighbours.neighbour(positions, choices)
+            hops[rows] += 1
+            return
+
+        # Weighted edges draw a varying number of neighbours per agent, taken one agent at a
+        # time so the generator is drawn in the object engine's order
+        rng = self.city_agent.rng
+        for row in rows:
+            position = int(self.positions[row])
+            budget = self.travel_budgets[row] + 1
+            target = int(self.patrol_targets[row])
+            for step in range(len(self.node_list)):
+                if budget <= 0:
+                    break
+                if target < 0:
+                    target = int(self.neighbours.neighbour(position, rng.integers(self.neighbours.degrees(position))))
+                weight = self.routing.edge_weight_by_index(position, target)
+                if weight > budget:
+                    break
+                budget -= weight
+                position = target
+                target = -1
+                hops[row] += 1
+            self.positions[row] = position
+            self.travel_budgets[row] = budget
+            self.patrol_targets[row] = target